@@ -1,13 +1,27 @@
 import json
+import hashlib
+import datetime
+import decimal
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 
 try:
     import pyodbc
+    pyodbc.pooling = True
     USE_PYODBC = True
 except ImportError:
     import pymssql
     USE_PYODBC = False
+try:
+    import pyarrow as pa
+    USE_PYARROW = True
+except ImportError:
+    USE_PYARROW = False
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -17,19 +31,87 @@ import streamlit as st
 CONFIG_PATH = Path("config.json")     # มี old_db/new_db/driver/encrypt/trust_server_cert
 TABLES_PATH = Path("tables.json")     # {"master":[...], "transaction":[...]}
 
+FETCH_BATCH_ROWS = 10_000               # จำนวนแถวต่อรอบ fetchmany ใน read_frame
+
+# ชนิด Python ใน cursor.description ของ pyodbc -> dtype ของ numpy (ที่ไม่อยู่ในนี้ให้ pandas เดาเอง)
+# datetime ใช้ความละเอียด us เพราะ ns ล้นกับค่าอย่าง 9999-12-31 ที่พบบ่อยใน SQL Server
+ODBC_NUMPY_DTYPES = {
+    int: "int64",
+    float: "float64",
+    bool: "bool",
+    datetime.datetime: "datetime64[us]",
+}
+
+# ชนิด Python ใน cursor.description ของ pyodbc -> ชนิด Arrow (DECIMAL สร้างจาก precision/scale ของคอลัมน์แยกต่างหาก)
+ODBC_ARROW_TYPES = {
+    int: pa.int64(),
+    float: pa.float64(),
+    bool: pa.bool_(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    bytearray: pa.binary(),
+    datetime.datetime: pa.timestamp("us"),
+    datetime.date: pa.date32(),
+    datetime.time: pa.time64("us"),
+} if USE_PYARROW else {}
+
+MAX_COMPARE_WORKERS = 4                # จำนวนตารางที่เปรียบเทียบพร้อมกัน (1 คู่ connection ต่อ worker)
+
+METADATA_CACHE_TTL = 300             # วินาทีที่เชื่อผล metadata (คอลัมน์/partition) ใน cache ก่อนถามใหม่
+PREVIEW_SAMPLE_MAX_AGE = 120         # วินาทีที่ quick diff ใช้ sample ของ preview ซ้ำได้
+CONN_PROBE_INTERVAL = 15             # วินาที: connection ที่เพิ่งตรวจด้วย SELECT 1 ไม่ต้องตรวจซ้ำ
+
+@st.cache_resource
+def metadata_caches() -> Dict[str, dict]:
+    """
+    dict ที่อยู่ข้าม rerun/session (Streamlit exec สคริปต์ใหม่ทุก rerun ตัวแปรระดับ module จึงถูกสร้างใหม่ทุกครั้ง)
+    key = (conn_str, table) -> (เวลาที่ดึง, ค่า) จึงใช้ร่วมกันได้ทุก connection ที่ชี้ฐานเดียวกัน
+    """
+    return {"columns": {}, "partition": {}, "clr": {}}
+
+# cache คอลัมน์ต่อ (conn_str, table): [(ชื่อคอลัมน์, column_id)]
+_COLUMNS_CACHE: Dict[Tuple[object, str], Tuple[float, List[Tuple[str, int]]]] = metadata_caches()["columns"]
+
+# cache คอลัมน์ชนิด CLR ต่อ (conn_str, table): [ชื่อคอลัมน์]
+_CLR_CACHE: Dict[Tuple[object, str], Tuple[float, List[str]]] = metadata_caches()["clr"]
+
+# cache คอลัมน์ partition ต่อ (conn_str, table): (ชื่อคอลัมน์, ชนิดข้อมูล) หรือ None = ไม่ได้ partition
+_PARTITION_CACHE: Dict[Tuple[object, str], Tuple[float, Optional[Tuple[str, str]]]] = metadata_caches()["partition"]
+
+# id(connection) -> conn_str ของ connection ที่เปิด/ใช้ใน rerun นี้ (ใช้สร้าง key ของ cache ด้านบน)
+_CONN_KEYS: Dict[int, object] = {}
+
+DATE_TYPES = {"date", "datetime", "datetime2", "smalldatetime", "datetimeoffset"}
+
+# ชื่อ object -> [ชื่อ] (จำนวนจำกัดตามชื่อตาราง/คอลัมน์ที่เคยเห็น)
+_QUOTE_IDENT_CACHE: Dict[str, str] = {}
+
 # ================================
 # Base Utils
 # ================================
 def quote_ident(name: str) -> str:
-    """ป้องกันชื่อ object ที่มีอักขระพิเศษ"""
-    return f"[{name.replace(']', ']]')}]"
+    """ป้องกันชื่อ object ที่มีอักขระพิเศษ (จำผลต่อชื่อ — ชื่อคอลัมน์ถูกใช้ซ้ำทุกครั้งที่สร้าง query)"""
+    quoted = _QUOTE_IDENT_CACHE.get(name)
+    if quoted is None:
+        quoted = _QUOTE_IDENT_CACHE[name] = f"[{name.replace(']', ']]')}]"
+    return quoted
+
+@st.cache_data(show_spinner=False)
+def read_json_cached(path_str: str, mtime_ns: int) -> dict:
+    """อ่าน/parse JSON ครั้งเดียวต่อเวอร์ชันไฟล์ (mtime_ns เป็นส่วนหนึ่งของ cache key) ไม่ต้องอ่านดิสก์ทุก rerun"""
+    return json.loads(Path(path_str).read_text(encoding="utf-8"))
+
+@st.cache_data(show_spinner=False)
+def json_text_cached(path_str: str, mtime_ns: int) -> str:
+    """ข้อความ JSON แบบจัดรูปแล้วสำหรับแสดงใน editor (serialize ใหม่เมื่อไฟล์เปลี่ยนเท่านั้น)"""
+    return json.dumps(read_json_cached(path_str, mtime_ns), ensure_ascii=False, indent=2)
 
 def load_json(path: Path, default) -> dict:
     if not path.exists():
         path.write_text(json.dumps(default, ensure_ascii=False, indent=2), encoding="utf-8")
         return default
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        return read_json_cached(str(path), path.stat().st_mtime_ns)
     except Exception as e:
         st.error(f"โหลดไฟล์ {path.name} ไม่สำเร็จ: {e}")
         return default
@@ -53,6 +135,8 @@ def load_config() -> dict:
         "driver": "ODBC Driver 17 for SQL Server",
         "encrypt": True,
         "trust_server_cert": True,
+        # ชื่อ linked server บน OLD ที่ชี้ไปยัง server ของ NEW (ว่าง = ไม่มี)
+        "linked_server_name": "",
     }
     return load_json(CONFIG_PATH, default_cfg)
 
@@ -93,9 +177,45 @@ def build_conn_str(cfg: dict, which: str) -> str:
             st.warning("pymssql ไม่รองรับ instance name (\\) กรุณาใช้ IP หรือ host,port เช่น 10.0.0.5,1433")
         return (server, uid, pwd, database)
 
+def cross_db_pair(cfg: dict) -> Optional[Tuple[str, str]]:
+    """
+    คืน (old_database, new_database) เมื่อ OLD/NEW อยู่บน server เดียวกัน (ใช้ query ข้ามฐานได้) ไม่เช่นนั้น None
+    """
+    old, new = cfg.get("old_db", {}), cfg.get("new_db", {})
+    server_old = (old.get("server") or "").strip().lower()
+    server_new = (new.get("server") or "").strip().lower()
+    db_old, db_new = old.get("database", ""), new.get("database", "")
+    if server_old and server_old == server_new and db_old and db_new:
+        return db_old, db_new
+    return None
+
+def new_ref_prefix(cfg: dict) -> Optional[str]:
+    """
+    ส่วนหน้าของชื่อตารางฝั่ง NEW ที่อ้างถึงได้จาก connection ฝั่ง OLD -> ให้ SQL Server เทียบเองใน query เดียว
+    server เดียวกัน -> [new_db]..; มี linked_server_name -> [linked].[new_db]..; ไม่เช่นนั้น None
+    """
+    db_new = cfg.get("new_db", {}).get("database", "")
+    if not db_new:
+        return None
+    linked = (cfg.get("linked_server_name") or "").strip()
+    if linked:
+        return f"{quote_ident(linked)}.{quote_ident(db_new)}.."
+    if cross_db_pair(cfg):
+        return f"{quote_ident(db_new)}.."
+    return None
+
+def new_table_ref(cfg: dict, table: str) -> Optional[str]:
+    """ชื่อเต็มของตารางฝั่ง NEW จาก connection ฝั่ง OLD ([new_db]..[T] / [linked].[new_db]..[T]) หรือ None"""
+    prefix = new_ref_prefix(cfg)
+    return f"{prefix}{quote_ident(table)}" if prefix else None
+
+def config_signature(cfg: dict) -> str:
+    """ลายเซ็นของ config สำหรับใช้เป็น key ของ cache (เปลี่ยนเมื่อ config เปลี่ยน)"""
+    return hashlib.md5(json.dumps(cfg, sort_keys=True).encode("utf-8")).hexdigest()
+
 def open_conn(conn_str):
     if USE_PYODBC:
-        return pyodbc.connect(conn_str, timeout=10)
+        conn = pyodbc.connect(conn_str, timeout=10, autocommit=True)
     else:
         server, user, pwd, db = conn_str
         # ถ้า server ไม่มี ,port และไม่ใช่ localhost ให้เตือน
@@ -104,58 +224,244 @@ def open_conn(conn_str):
         if server and (server != "localhost") and ("," not in server):
             st.info("แนะนำให้ระบุ port เช่น 10.0.0.5,1433 หรือ myserver,1433 สำหรับ pymssql")
         try:
-            return pymssql.connect(server=server, user=user, password=pwd, database=db, login_timeout=10)
+            conn = pymssql.connect(server=server, user=user, password=pwd, database=db,
+                                   login_timeout=10, autocommit=True)
         except Exception as e:
             st.error(f"pymssql connect error: {e}\n\nหากใช้ instance name ให้เปลี่ยนเป็น host,port และตรวจสอบ firewall/network")
             raise
+    _CONN_KEYS[id(conn)] = conn_str
+    return conn
+
+def close_quietly(conn) -> None:
+    _CONN_KEYS.pop(id(conn), None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def get_conn(which: str, conn_str):
+    """
+    connection ที่ค้างไว้ใน st.session_state ต่อฝั่ง ('old' | 'new') ใช้ซ้ำข้าม rerun
+    ตรวจด้วย SELECT 1 ก่อนคืน (ไม่เกินครั้งละ CONN_PROBE_INTERVAL วินาที เพราะหนึ่ง rerun เรียกหลายจุด)
+    ถ้าหลุดหรือ conn_str เปลี่ยนจะเปิดใหม่
+    """
+    key = f"conn_{which}"
+    entry = st.session_state.get(key)
+    if entry is not None:
+        conn, cached_str, checked_at = entry
+        if cached_str == conn_str:
+            now = time.monotonic()
+            if now - checked_at < CONN_PROBE_INTERVAL:
+                _CONN_KEYS[id(conn)] = conn_str
+                return conn
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    cur.fetchall()
+                _CONN_KEYS[id(conn)] = conn_str
+                st.session_state[key] = (conn, conn_str, now)
+                return conn
+            except Exception:
+                pass
+        close_quietly(conn)
+        del st.session_state[key]
+
+    conn = open_conn(conn_str)
+    st.session_state[key] = (conn, conn_str, time.monotonic())
+    return conn
+
+def reset_conns() -> None:
+    """ปิด connection ที่ค้างไว้ทั้งหมด (ปุ่ม Reconnect)"""
+    for key in ("conn_old", "conn_new"):
+        entry = st.session_state.pop(key, None)
+        if entry is not None:
+            close_quietly(entry[0])
+    st.session_state.pop("common_cols_cache", None)
+    _COLUMNS_CACHE.clear()
+    _PARTITION_CACHE.clear()
+    _CLR_CACHE.clear()
 
 # ================================
 # DB Metadata / Quick Checks
 # ================================
-def q_columns(conn, table_name: str) -> List[Tuple[str, int]]:
-    """
-    คืน [(column_name, column_id)] เรียงตามลำดับคอลัมน์ในตาราง
-    """
-    sql = """
+Q_COLUMNS_SQL = """
     SELECT c.name AS col_name, c.column_id
     FROM sys.columns c
     INNER JOIN sys.objects o ON c.object_id = o.object_id
     WHERE o.type IN ('U') AND o.name = ?
     ORDER BY c.column_id
     """
+
+def cached_metadata(cache: dict, conn, table_name: str, loader):
+    """
+    คืนผล loader(conn, table_name) จาก cache ตาม (conn_str, table) ถ้ายังไม่เกิน METADATA_CACHE_TTL
+    connection ที่ไม่ได้เปิดผ่าน open_conn/get_conn (ไม่รู้ conn_str) -> ถามฐานทุกครั้ง
+    """
+    conn_key = _CONN_KEYS.get(id(conn))
+    if conn_key is None:
+        return loader(conn, table_name)
+    key = (conn_key, table_name)
+    hit = cache.get(key)
+    if hit is not None and time.monotonic() - hit[0] < METADATA_CACHE_TTL:
+        return hit[1]
+    value = loader(conn, table_name)
+    cache[key] = (time.monotonic(), value)
+    return value
+
+def load_columns(conn, table_name: str) -> List[Tuple[str, int]]:
     with conn.cursor() as cur:
-        cur.execute(sql, (table_name,))
+        cur.execute(Q_COLUMNS_SQL, (table_name,))
         return [(r[0], int(r[1])) for r in cur.fetchall()]
 
+def prefetch_columns(conn, table_names: List[str]) -> None:
+    """
+    ดึงคอลัมน์ของหลายตารางใน query เดียว (IN list ทีละไม่เกิน 2000 parameter) แล้วเติม cache ของ q_columns
+    -> compare หลายตารางไม่ต้องถาม sys.columns ทีละตาราง
+    """
+    conn_key = _CONN_KEYS.get(id(conn))
+    if conn_key is None or not table_names:
+        return
+    # collation ของ sys.objects มักไม่สนตัวพิมพ์ -> ชื่อที่ได้กลับมาอาจไม่ตรงกับชื่อใน tables.json (doc_header / DOC_Header)
+    # จึงจับคู่กลับเป็นชื่อที่ขอด้วย casefold
+    requested = {t.casefold(): t for t in table_names}
+    found: Dict[str, List[Tuple[str, int]]] = {}
+    with conn.cursor() as cur:
+        for i in range(0, len(table_names), 2000):
+            chunk = table_names[i:i + 2000]
+            cur.execute(
+                "SELECT o.name, c.name, c.column_id FROM sys.columns c "
+                "INNER JOIN sys.objects o ON c.object_id = o.object_id "
+                f"WHERE o.type IN ('U') AND o.name IN ({', '.join('?' * len(chunk))}) "
+                "ORDER BY o.name, c.column_id",
+                chunk,
+            )
+            for table, col, col_id in cur.fetchall():
+                key = requested.get(table.casefold())
+                if key is not None:
+                    found.setdefault(key, []).append((col, int(col_id)))
+    # ตารางที่ไม่ได้ผลเลย (ชื่อมี schema, ไม่มีจริง ฯลฯ) ไม่ cache -> q_columns ถามเองตามปกติ
+    now = time.monotonic()
+    for table, cols in found.items():
+        _COLUMNS_CACHE[(conn_key, table)] = (now, cols)
+
+def q_columns(conn, table_name: str) -> List[Tuple[str, int]]:
+    """
+    คืน [(column_name, column_id)] เรียงตามลำดับคอลัมน์ในตาราง (cache ข้าม rerun ตาม conn_str)
+    """
+    return cached_metadata(_COLUMNS_CACHE, conn, table_name, load_columns)
+
+Q_CLR_COLUMNS_SQL = """
+    SELECT c.name
+    FROM sys.columns c
+    INNER JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+    WHERE c.object_id = OBJECT_ID(?) AND ty.is_assembly_type = 1
+    """
+
+def load_clr_columns(conn, table_name: str) -> List[str]:
+    with conn.cursor() as cur:
+        cur.execute(Q_CLR_COLUMNS_SQL, (quote_ident(table_name),))
+        return [r[0] for r in cur.fetchall()]
+
+def q_clr_columns(conn, table_name: str) -> List[str]:
+    """
+    คอลัมน์ชนิด CLR (geography/geometry/hierarchyid/UDT) ที่ FOR JSON แปลงไม่ได้ (error 13604)
+    -> ต้องไม่อยู่ในชุดคอลัมน์ที่ส่งให้ row_hash_sql (cache ข้าม rerun ตาม conn_str)
+    """
+    return cached_metadata(_CLR_CACHE, conn, table_name, load_clr_columns)
+
+# อ่าน row_count จาก sys.dm_db_partition_stats (heap/clustered index) ไม่ต้อง scan ตาราง (นับแบบ exact อยู่ใน q_table_summary)
+# ห่อด้วย sp_executesql ให้ข้อความ statement เหมือนกันทุกตาราง -> SQL Server ใช้ plan เดิมซ้ำได้; parameter = quote_ident(table)
+Q_ROWCOUNT_SQL = (
+    "EXEC sp_executesql N'SELECT ISNULL(SUM(row_count), 0) FROM sys.dm_db_partition_stats "
+    "WHERE object_id = OBJECT_ID(@t) AND index_id IN (0, 1)', N'@t NVARCHAR(776)', @t = ?"
+)
+
+def row_hash_sql(cols: List[str], algo: str = "SHA1", alias: str = "t") -> str:
+    """
+    นิพจน์ HASHBYTES ต่อแถวจาก JSON ของคอลัมน์ (NULL/วันที่/ทศนิยมแทนค่าแบบคงที่ทั้งสองฝั่ง)
+    cols ต้องไม่มีคอลัมน์ชนิด CLR (q_clr_columns) เพราะ FOR JSON แปลงไม่ได้
+    """
+    col_sql = ", ".join(f"{alias}.{quote_ident(c)}" for c in cols)
+    return f"HASHBYTES('{algo}', (SELECT {col_sql} FOR JSON PATH, WITHOUT_ARRAY_WRAPPER, INCLUDE_NULL_VALUES))"
+
+def row_hash64_sql(cols: List[str], algo: str = "MD5", alias: str = "t") -> str:
+    """8 byte แรกของ row_hash_sql เป็น BIGINT -> ส่ง/เทียบเป็น int64 แทน binary 16-20 byte ต่อแถว"""
+    return f"CONVERT(BIGINT, SUBSTRING({row_hash_sql(cols, algo, alias)}, 1, 8))"
+
+def checksum_agg_sql(cols: Optional[List[str]] = None) -> str:
+    """
+    นิพจน์ aggregate ของ checksum ระดับตาราง (ใช้กับ FROM <table> t)
+    SHA1 ต่อแถวจาก JSON ของคอลัมน์ที่กำหนด (NULL/วันที่/ทศนิยมแทนค่าแบบคงที่)
+    แล้วรวม 8 byte แรกด้วย SUM แบบ DECIMAL(38) กัน overflow; ไม่ระบุคอลัมน์ -> SUM(BINARY_CHECKSUM(*))
+    """
+    if not cols:
+        return "ISNULL(SUM(CONVERT(BIGINT, BINARY_CHECKSUM(*))), 0)"
+    return f"ISNULL(SUM(CONVERT(DECIMAL(38, 0), {row_hash64_sql(cols, 'SHA1')})), 0)"
+
+def checksum_sql(table_name: str, cols: Optional[List[str]] = None) -> str:
+    return f"SELECT {checksum_agg_sql(cols)} FROM {quote_ident(table_name)} t"
+
 def q_rowcount(conn, table_name: str) -> int:
-    sql = f"SELECT COUNT_BIG(1) FROM {quote_ident(table_name)} WITH (NOLOCK)"
+    """จำนวนแถวจาก metadata (Q_ROWCOUNT_SQL) ค่าอาจคลาดได้ระหว่างมีการเขียน"""
     with conn.cursor() as cur:
-        cur.execute(sql)
+        cur.execute(Q_ROWCOUNT_SQL, (quote_ident(table_name),))
         return int(cur.fetchone()[0])
 
-def q_checksum(conn, table_name: str) -> int:
+def q_checksum(conn, table_name: str, cols: Optional[List[str]] = None) -> int:
     """
-    SUM(BINARY_CHECKSUM(*)) — เร็วและพอจับต่างได้ (ไม่ใช่ 100% เท่าการเทียบทุกแถวทุกคอลัมน์)
+    ใช้ HASHBYTES ต่อแถวเมื่อระบุคอลัมน์ (ควรเป็นคอลัมน์ร่วม OLD/NEW ชุดเดียวกัน) ไม่เช่นนั้น BINARY_CHECKSUM
     """
-    sql = f"SELECT ISNULL(SUM(BINARY_CHECKSUM(*)), 0) FROM {quote_ident(table_name)} WITH (NOLOCK)"
     with conn.cursor() as cur:
-        cur.execute(sql)
+        cur.execute(checksum_sql(table_name, cols))
         return int(cur.fetchone()[0])
 
+def q_table_summary(conn, table_name: str, cols: Optional[List[str]] = None) -> Tuple[int, int]:
+    """ดึง (COUNT_BIG, checksum) จาก SELECT เดียวกัน -> scan ตารางครั้งเดียว ส่งครั้งเดียว"""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT_BIG(*), {checksum_agg_sql(cols)} FROM {quote_ident(table_name)} t")
+        rowcount, checksum = cur.fetchone()
+    return int(rowcount), int(checksum)
+
+@st.cache_resource
+def side_pool() -> ThreadPoolExecutor:
+    """
+    thread pool กลางสำหรับ run_both_sides (ไม่ต้องสร้าง/ทิ้ง thread ทุก query)
+    งานใน pool ไม่ submit งานต่อ จึงใช้ร่วมกับ worker ของ iter_compare_tables ได้โดยไม่ deadlock
+    """
+    return ThreadPoolExecutor(max_workers=2 * MAX_COMPARE_WORKERS, thread_name_prefix="db-side")
+
+# ดึง pool จาก thread หลักตอนรันสคริปต์ (worker thread ไม่มี ScriptRunContext สำหรับ st.cache_resource)
+_SIDE_POOL = side_pool()
+
+def run_both_sides(fn, conn_old, conn_new, *args, **kwargs) -> Tuple:
+    """เรียก fn(conn, ...) กับ OLD/NEW พร้อมกัน (คนละ connection จึงรันขนานได้) คืน (ผล OLD, ผล NEW)"""
+    ex = _SIDE_POOL
+    fut_old = ex.submit(fn, conn_old, *args, **kwargs)
+    fut_new = ex.submit(fn, conn_new, *args, **kwargs)
+    return fut_old.result(), fut_new.result()
+
 def common_columns(conn_old, conn_new, table_name: str) -> List[str]:
     cols_old = [c for c, _ in q_columns(conn_old, table_name)]
-    cols_new = [c for c, _ in q_columns(conn_new, table_name)]
+    cols_new = {c for c, _ in q_columns(conn_new, table_name)}
     return [c for c in cols_old if c in cols_new]  # รักษาลำดับตาม OLD
 
+def session_common_columns(conn_old, conn_new, table_name: str, cfg_sig: str) -> List[str]:
+    """
+    common_columns ที่จำผลไว้ใน st.session_state ข้าม rerun (key = config + ตาราง)
+    ล้างเมื่อบันทึก tables.json หรือเปลี่ยน config
+    """
+    cache = st.session_state.setdefault("common_cols_cache", {})
+    key = (cfg_sig, table_name)
+    if key not in cache:
+        cache[key] = common_columns(conn_old, conn_new, table_name)
+    return cache[key]
+
 # ================================
 # Compare Logic
 # ================================
-def compare_table(conn_old, conn_new, table_name: str) -> dict:
-    """
-    เปรียบเทียบ schema (แค่ชื่อคอลัมน์/ลำดับ), row count, checksum
-    ถ้าต่าง -> ดึงตัวอย่างแถวที่ต่าง (จากชุดคอลัมน์ร่วม) ด้วยการเทียบใน Python
-    """
-    res = {
+def new_compare_result(table_name: str) -> dict:
+    """ผลของ compare_table ก่อนเริ่มเทียบ (ใช้สร้างผล error ของตารางที่เปิด connection ไม่ได้ด้วย)"""
+    return {
         "table": table_name,
         "schema_equal": True,
         "rowcount_old": None,
@@ -164,40 +470,109 @@ def compare_table(conn_old, conn_new, table_name: str) -> dict:
         "checksum_new": None,
         "ok": True,                 # true = ไม่มีความต่างด้านข้อมูล (rowcount/checksum เท่ากัน)
         "messages": [],
-        "only_in_old": [],
-        "only_in_new": [],
+        "only_in_old": pd.DataFrame(),  # แถวตัวอย่างที่มีเฉพาะฝั่ง (เก็บเป็น DataFrame ส่งให้ st.dataframe ได้เลย)
+        "only_in_new": pd.DataFrame(),
         "columns_used": [],
+        "pk_cols": [],
+        "changed_keys": [],         # PK ของแถวที่มีทั้งสองฝั่งแต่ค่าต่างกัน
+        "changed_cells": pd.DataFrame(),  # (PK..., column, OLD, NEW) ของ changed_keys เฉพาะช่องที่ค่าต่าง
     }
 
+def compare_table(conn_old, conn_new, table_name: str,
+                  new_prefix: Optional[str] = None,
+                  exact_rowcount: bool = True) -> dict:
+    """
+    เปรียบเทียบ schema (แค่ชื่อคอลัมน์/ลำดับ), row count, checksum
+    ถ้าต่าง -> หาแถวที่ต่าง (จากชุดคอลัมน์ร่วม): new_prefix (NEW อ้างถึงได้จาก OLD) -> anti-join/hash join ฝั่ง server,
+    ไม่เช่นนั้น มี PK -> เทียบ (PK, hash) ทั้งตาราง, ไม่มี PK -> เทียบ hash ของแถวทั้งตาราง
+    มี PK: แถวที่มีฝั่งเดียว = PK ที่ไม่มีอีกฝั่ง, แถวที่ค่าต่าง = changed_keys; ไม่มี PK: แถวที่ค่าต่างอยู่ในแถวที่มีฝั่งเดียวทั้งสองฝั่ง
+    """
+    res = new_compare_result(table_name)
+
     try:
-        cols_old = [c for c, _ in q_columns(conn_old, table_name)]
-        cols_new = [c for c, _ in q_columns(conn_new, table_name)]
+        meta_old, meta_new = run_both_sides(q_columns, conn_old, conn_new, table_name)
+        cols_old = [c for c, _ in meta_old]
+        cols_new = [c for c, _ in meta_new]
+        set_old, set_new = set(cols_old), set(cols_new)
         if cols_old != cols_new:
             res["schema_equal"] = False
-            miss_new = [c for c in cols_old if c not in cols_new]
-            miss_old = [c for c in cols_new if c not in cols_old]
+            miss_new = [c for c in cols_old if c not in set_new]
+            miss_old = [c for c in cols_new if c not in set_old]
             if miss_new:
                 res["messages"].append(f"คอลัมน์ใน OLD ที่ไม่มีใน NEW: {', '.join(miss_new)}")
             if miss_old:
                 res["messages"].append(f"คอลัมน์ใน NEW ที่ไม่มีใน OLD: {', '.join(miss_old)}")
 
-        res["rowcount_old"] = q_rowcount(conn_old, table_name)
-        res["rowcount_new"] = q_rowcount(conn_new, table_name)
+        # checksum ต้องคำนวณจากคอลัมน์ชุดเดียวกันทั้งสองฝั่ง -> ใช้คอลัมน์ร่วม
+        # ยกเว้นคอลัมน์ชนิด CLR ที่ FOR JSON ของ row hash แปลงไม่ได้
+        clr_old, clr_new = run_both_sides(q_clr_columns, conn_old, conn_new, table_name)
+        clr = set(clr_old) | set(clr_new)
+        cols_common = [c for c in cols_old if c in set_new and c not in clr]
+        skipped = [c for c in cols_old if c in set_new and c in clr]
+        if skipped:
+            res["messages"].append(f"ไม่ได้เทียบคอลัมน์ชนิด CLR (geography/geometry/hierarchyid): {', '.join(skipped)}")
+        if exact_rowcount:
+            (res["rowcount_old"], res["checksum_old"]), (res["rowcount_new"], res["checksum_new"]) = run_both_sides(
+                q_table_summary, conn_old, conn_new, table_name, cols_common
+            )
+        else:
+            # นับจาก metadata ก่อน (ไม่ scan) ถ้าต่างแล้วก็ตัดสินได้ว่าข้อมูลต่าง -> ข้าม checksum ที่ต้อง scan ทั้งตาราง
+            res["rowcount_old"], res["rowcount_new"] = run_both_sides(q_rowcount, conn_old, conn_new, table_name)
+            if res["rowcount_old"] == res["rowcount_new"]:
+                res["checksum_old"], res["checksum_new"] = run_both_sides(q_checksum, conn_old, conn_new,
+                                                                          table_name, cols_common)
         if res["rowcount_old"] != res["rowcount_new"]:
             res["ok"] = False
             res["messages"].append(f"Row count ต่างกัน (OLD={res['rowcount_old']}, NEW={res['rowcount_new']})")
 
-        res["checksum_old"] = q_checksum(conn_old, table_name)
-        res["checksum_new"] = q_checksum(conn_new, table_name)
         if res["checksum_old"] != res["checksum_new"]:
             res["ok"] = False
             res["messages"].append("Checksum ต่างกัน")
 
-        if not res["ok"]:
-            only_old, only_new, cols_used = sample_row_diffs(conn_old, conn_new, table_name, limit=100)
-            res["only_in_old"] = only_old
-            res["only_in_new"] = only_new
-            res["columns_used"] = cols_used
+        # schema/rowcount/checksum ตรงกัน (กรณีส่วนใหญ่) -> ไม่ต้องดึง PK หรือ sample เพิ่ม
+        if res["ok"] or not cols_common:
+            return res
+
+        # PK หลายคอลัมน์ที่ NEW ขาดบางคอลัมน์ -> ตัดเหลือ prefix จะไม่ unique จึงไม่ใช้ PK เลย
+        pk_cols = q_pk_columns(conn_old, table_name)
+        if not all(c in set_new for c in pk_cols):
+            pk_cols = []
+        res["pk_cols"] = pk_cols
+        if not (res["rowcount_old"] or res["rowcount_new"]):
+            return res
+
+        if new_prefix:
+            # NEW อ้างถึงได้จาก OLD (server เดียวกัน / linked server) -> ให้ SQL Server หาแถวที่ต่างเอง
+            # มี PK: only_in_* = PK ที่ไม่มีอีกฝั่ง + changed_keys (ความหมายเดียวกับ hash_key_diff)
+            old_ref, new_ref = quote_ident(table_name), f"{new_prefix}{quote_ident(table_name)}"
+            res["only_in_old"] = q_except_diff(conn_old, old_ref, new_ref, cols_common, 100, pk_cols)
+            res["only_in_new"] = q_except_diff(conn_old, new_ref, old_ref, cols_common, 100, pk_cols)
+            res["columns_used"] = cols_common
+            if pk_cols:
+                res["changed_keys"] = changed_row_keys(conn_old, table_name, pk_cols, cols_common, new_ref, limit=100)
+        else:
+            # ดึงแค่ (PK, hash) สองฝั่ง หา PK ที่ต่างจากทั้งตาราง แล้วดึงแถวเต็มเฉพาะ PK เหล่านั้น
+            key_diff = hash_key_diff(conn_old, conn_new, table_name, pk_cols, cols_common, limit=100) if pk_cols else None
+            if pk_cols and key_diff is None:
+                res["messages"].append("พบค่า PK ซ้ำ -> หาแถวที่ต่างด้วย hash ของทั้งแถวแทน (ไม่แจกแจงรายช่อง)")
+                pk_cols = res["pk_cols"] = []
+            if key_diff is not None:
+                keys_old, keys_new, res["changed_keys"] = key_diff
+                if keys_old:
+                    res["only_in_old"] = q_rows_by_keys(conn_old, table_name, cols_common, pk_cols, keys_old)
+                if keys_new:
+                    res["only_in_new"] = q_rows_by_keys(conn_new, table_name, cols_common, pk_cols, keys_new)
+                res["columns_used"] = cols_common
+            else:
+                # ไม่มี PK -> แถวที่ค่าต่างนับเป็นแถวที่มีฝั่งเดียวทั้งสองฝั่ง (เหมือน q_except_diff แบบไม่มี PK)
+                res["only_in_old"], res["only_in_new"], res["columns_used"] = sample_row_diffs(
+                    conn_old, conn_new, table_name, cols_common, limit=100)
+
+        # แถวที่ PK ตรงกันแต่ค่าต่าง -> ดึงแถวเต็มสองฝั่งมาแจกแจงรายช่อง
+        if res["changed_keys"]:
+            rows_old, rows_new = run_both_sides(q_rows_by_keys, conn_old, conn_new, table_name,
+                                                cols_common, pk_cols, res["changed_keys"])
+            res["changed_cells"] = column_diffs(rows_old, rows_new, pk_cols)
 
         return res
     except Exception as e:
@@ -205,55 +580,470 @@ def compare_table(conn_old, conn_new, table_name: str) -> dict:
         res["messages"].append(f"เกิดข้อผิดพลาด: {e}")
         return res
 
-def sample_row_diffs(conn_old, conn_new, table: str, limit: int = 100) -> Tuple[List[Dict], List[Dict], List[str]]:
+def description_dtypes(cur) -> List[Optional[str]]:
+    """dtype ของ numpy ต่อคอลัมน์จาก cursor.description (pymssql ให้ type code กว้างเกินไป -> None)"""
+    if not USE_PYODBC or not cur.description:
+        return [None] * len(cur.description or [])
+    return [ODBC_NUMPY_DTYPES.get(d[1]) for d in cur.description]
+
+def typed_column(values: list, dtype: Optional[str]):
+    """สร้าง numpy array ตาม dtype ทีเดียวทั้งคอลัมน์; มี NULL ในคอลัมน์ int/bool หรือแปลงไม่ได้ -> คืน list เดิม"""
+    if dtype is None:
+        return values
+    if dtype in ("int64", "bool") and any(v is None for v in values):
+        return values
+    try:
+        return np.asarray(values, dtype=dtype)
+    except (TypeError, ValueError, OverflowError):
+        return values
+
+def description_arrow_types(cur) -> list:
     """
-    ดึง sample สองชุดจาก OLD/NEW และหาค่าที่ต่างกันเชิงค่า (เฉพาะคอลัมน์ร่วม)
+    ชนิด Arrow ต่อคอลัมน์จาก cursor.description (type code d[1], precision d[4], scale d[5])
+    -> ชนิดมาจาก schema ไม่ได้เดาจากค่า สองฝั่งจึงได้ชนิดเดียวกัน (เช่น DECIMAL precision) แม้ผลว่าง
+    pymssql หรือชนิดที่ไม่รู้จัก -> None (ให้ Arrow เดาจากค่า)
     """
-    cols = common_columns(conn_old, conn_new, table)
-    if not cols:
-        return [], [], []
+    if not USE_PYODBC or not cur.description:
+        return [None] * len(cur.description or [])
+    types = []
+    for d in cur.description:
+        if d[1] is decimal.Decimal and d[4]:
+            types.append((pa.decimal128 if d[4] <= 38 else pa.decimal256)(d[4], d[5] or 0))
+        else:
+            types.append(ODBC_ARROW_TYPES.get(d[1]))
+    return types
+
+def arrow_chunk(values, arrow_type=None):
+    """แปลงค่าหนึ่ง batch ของคอลัมน์เป็น pa.Array (ระดับ C) ตามชนิดที่กำหนด; แปลงไม่ได้ -> ให้ Arrow เดาชนิด -> ไม่ได้อีก คืน list เดิม"""
+    for t in ((arrow_type, None) if arrow_type is not None else (None,)):
+        try:
+            return pa.array(values, type=t, from_pandas=True)
+        except (pa.ArrowException, TypeError, ValueError, OverflowError):
+            pass
+    return list(values)
+
+def arrow_column(chunks: list, dtype: Optional[str], arrow_type=None):
+    """
+    รวม chunk ของคอลัมน์เป็น Arrow ChunkedArray (ไม่ copy ข้อมูลซ้ำ)
+    ผลว่างแต่รู้ชนิดจาก cursor.description -> คอลัมน์ Arrow ว่างชนิดเดียวกับฝั่งที่มีข้อมูล
+    ชนิดต่างกันระหว่าง batch (batch ที่ต้องเดาชนิดเอง, NULL ล้วน) -> promote เป็นชนิดร่วม
+    มี batch ที่แปลงไม่ได้หรือรวมชนิดไม่ได้ -> กลับไปใช้ typed_column กับค่าทั้งคอลัมน์
+    """
+    if not chunks and arrow_type is not None:
+        return pd.arrays.ArrowExtensionArray(pa.chunked_array([], type=arrow_type))
+    if chunks and all(isinstance(ch, pa.Array) for ch in chunks):
+        types = ([arrow_type] if arrow_type is not None else []) + [ch.type for ch in chunks]
+        try:
+            target = pa.unify_schemas(
+                [pa.schema([("v", t)]) for t in types], promote_options="permissive"
+            ).field("v").type
+            return pd.arrays.ArrowExtensionArray(pa.chunked_array([ch.cast(target) for ch in chunks], type=target))
+        except (pa.ArrowException, TypeError, ValueError):
+            pass
+    values = [v for ch in chunks for v in (ch.to_pylist() if isinstance(ch, pa.Array) else ch)]
+    return typed_column(values, dtype)
+
+def read_frame(cur, columns: List[str]) -> pd.DataFrame:
+    """
+    อ่านผลจาก cursor ที่ execute แล้วทีละ batch (fetchmany) แยกเป็นคอลัมน์ทันที
+    -> ไม่ต้องถือ Row ทั้งชุดพร้อม DataFrame (peak memory ต่ำกว่า)
+    มี pyarrow -> แปลงแต่ละ batch เป็น Arrow ตามชนิดใน cursor.description ทันที ถือ object ของ Python แค่ batch เดียว;
+    ไม่เช่นนั้นสะสมเป็น list แล้วแปลงเป็น numpy ตามชนิดใน cursor.description ครั้งเดียวทั้งคอลัมน์
+    """
+    dtypes = description_dtypes(cur) or [None] * len(columns)
+    arrow_types = (description_arrow_types(cur) if USE_PYARROW else None) or [None] * len(columns)
+    buffers: List[list] = [[] for _ in columns]
+    while True:
+        batch = cur.fetchmany(FETCH_BATCH_ROWS)
+        if not batch:
+            break
+        for buf, values, at in zip(buffers, zip(*batch), arrow_types):
+            if USE_PYARROW:
+                buf.append(arrow_chunk(values, at))
+            else:
+                buf.extend(values)
+    if USE_PYARROW:
+        data = {c: arrow_column(buf, dt, at) for c, buf, dt, at in zip(columns, buffers, dtypes, arrow_types)}
+    else:
+        data = {c: typed_column(buf, dt) for c, buf, dt in zip(columns, buffers, dtypes)}
+    return pd.DataFrame(data, columns=columns)
+
+Q_PK_COLUMNS_SQL = """
+    SELECT c.name
+    FROM sys.indexes i
+    INNER JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    INNER JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    WHERE i.object_id = OBJECT_ID(?) AND i.is_primary_key = 1
+    ORDER BY ic.key_ordinal
+    """
+
+def q_pk_columns(conn, table_name: str) -> List[str]:
+    """
+    คืนรายชื่อคอลัมน์ของ Primary Key เรียงตามลำดับใน index (ว่าง = ไม่มี PK)
+    """
+    with conn.cursor() as cur:
+        cur.execute(Q_PK_COLUMNS_SQL, (quote_ident(table_name),))
+        return [r[0] for r in cur.fetchall()]
+
+Q_PARTITION_COLUMN_SQL = """
+    SELECT TOP (1) c.name, t.name
+    FROM sys.indexes i
+    INNER JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+    INNER JOIN sys.index_columns ic
+        ON ic.object_id = i.object_id AND ic.index_id = i.index_id AND ic.partition_ordinal = 1
+    INNER JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    INNER JOIN sys.types t ON t.user_type_id = c.user_type_id
+    WHERE i.object_id = OBJECT_ID(?) AND i.index_id IN (0, 1)
+    """
+
+def load_partition_column(conn, table_name: str) -> Optional[Tuple[str, str]]:
+    with conn.cursor() as cur:
+        cur.execute(Q_PARTITION_COLUMN_SQL, (quote_ident(table_name),))
+        row = cur.fetchone()
+    return (row[0], row[1]) if row else None
 
-    df_old = fetch_table_sample(conn_old, table, columns=cols, top=limit)
-    df_new = fetch_table_sample(conn_new, table, columns=cols, top=limit)
+def q_partition_column(conn, table_name: str) -> Optional[Tuple[str, str]]:
+    """
+    คอลัมน์ partition ของ heap/clustered index -> (ชื่อคอลัมน์, ชนิดข้อมูล); ไม่ได้ partition -> None (cache ตาม conn_str)
+    """
+    return cached_metadata(_PARTITION_CACHE, conn, table_name, load_partition_column)
 
-    cols_use = [c for c in cols if c in df_old.columns and c in df_new.columns]
-    set_old = {tuple(str(x) for x in row) for row in df_old[cols_use].itertuples(index=False, name=None)}
-    set_new = {tuple(str(x) for x in row) for row in df_new[cols_use].itertuples(index=False, name=None)}
+def q_except_diff(conn, src_ref: str, dst_ref: str, cols: List[str], limit: int,
+                  key_cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    แถวของ src_ref ที่ไม่มีใน dst_ref ฝั่ง server (ชื่อที่ quote แล้ว อ้างถึงได้จาก conn: ข้ามฐาน / linked server)
+    key_cols (PK) -> แถวที่ไม่มี PK นั้นอีกฝั่ง (ความหมายเดียวกับ hash_key_diff; แถวที่ค่าต่างหาด้วย changed_row_keys)
+    ไม่มี PK -> เทียบ hash 64-bit ทั้งแถว (row_hash64_sql) แทน EXCEPT -> ใช้ได้กับคอลัมน์ xml/text/ntext/image
+    """
+    col_sql = ", ".join(f"s.{quote_ident(c)}" for c in cols)
+    if key_cols:
+        match_sql = " AND ".join(f"d.{quote_ident(c)} = s.{quote_ident(c)}" for c in key_cols)
+    else:
+        match_sql = f"{row_hash64_sql(cols, alias='d')} = {row_hash64_sql(cols, alias='s')}"
+    sql = (
+        f"SELECT TOP ({int(limit)}) {col_sql} FROM {src_ref} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {dst_ref} d WHERE {match_sql})"
+    )
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        return read_frame(cur, cols)
 
-    only_old = list(set_old - set_new)
-    only_new = list(set_new - set_old)
+def q_sample_except(conn, table: str, src_ref: str, dst_ref: str, cols: List[str],
+                    where: Optional[str] = None, order_by: Optional[str] = None, top: int = 200,
+                    recent_days: Optional[int] = None,
+                    nolock_src: bool = True, nolock_dst: bool = True) -> pd.DataFrame:
+    """
+    sample (TOP/WHERE/ORDER เดียวกันทั้งสองฝั่ง) ของ src_ref ที่ไม่อยู่ใน sample ของ dst_ref ใน query เดียว
+    src_ref/dst_ref เป็นชื่อที่ quote แล้ว (ตารางใน DB ปัจจุบัน / ข้ามฐาน / ผ่าน linked server)
+    table: ชื่อตารางใน DB ของ conn ใช้หาคอลัมน์ partition; recent_days ความหมายเดียวกับ fetch_table_sample
+    nolock_src/nolock_dst: ใส่ WITH (NOLOCK) แยกต่อฝั่ง — ตารางผ่าน linked server ใส่ table hint ไม่ได้ (Msg 7377)
+    เทียบด้วย hash 64-bit ต่อแถวแทน EXCEPT (เหมือน q_except_diff) -> ไม่ล้มกับคอลัมน์ xml/text/ntext/image
+    """
+    col_sql = ", ".join(quote_ident(c) for c in cols)
+    where = recent_partition_where(conn, table, where, recent_days)
+    where_sql = f" WHERE {where}" if where and where.strip() else ""
+    order_sql = f" ORDER BY {order_by}" if order_by and order_by.strip() else ""
+
+    def sample(ref: str, nolock: bool) -> str:
+        # ต่อข้อความตรง ๆ (ไม่ใช้ str.format) -> WHERE/ORDER ที่มี { } เช่น {d '2024-01-01'} ไม่ทำให้ล้ม
+        hint_sql = " WITH (NOLOCK)" if nolock else ""
+        return f"SELECT TOP (?) {col_sql} FROM {ref}{hint_sql}{where_sql}{order_sql}"
+
+    sql = (
+        f"SELECT {', '.join(f'a.{quote_ident(c)}' for c in cols)} FROM ({sample(src_ref, nolock_src)}) a "
+        f"WHERE NOT EXISTS (SELECT 1 FROM ({sample(dst_ref, nolock_dst)}) b "
+        f"WHERE {row_hash64_sql(cols, alias='b')} = {row_hash64_sql(cols, alias='a')})"
+    )
+    with conn.cursor() as cur:
+        cur.execute(sql, (int(top), int(top)))
+        return read_frame(cur, cols)
 
-    def to_dicts(tuples_list):
-        return [dict(zip(cols_use, t)) for t in tuples_list][:limit]
+def q_row_hashes(conn, table: str, pk_cols: List[str], cols: List[str]) -> pd.DataFrame:
+    """
+    ดึงเฉพาะ (PK, hash 64-bit ของแถว) — ส่งข้อมูล 8 byte + PK ต่อแถวแทนทุกคอลัมน์ (เทียบเป็น int64 ใน pandas)
+    pk_cols ว่าง -> ได้แค่คอลัมน์ __h ของทุกแถว
+    """
+    sel_sql = ", ".join([f"t.{quote_ident(c)}" for c in pk_cols] + [f"{row_hash64_sql(cols)} AS h"])
+    sql = f"SELECT {sel_sql} FROM {quote_ident(table)} t"
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        return read_frame(cur, pk_cols + ["__h"])
+
+def q_rows_by_hashes(conn, table: str, cols: List[str], hashes: List[int], limit: int = 100) -> pd.DataFrame:
+    """ดึงแถวเต็มที่ hash 64-bit (แบบเดียวกับ q_row_hashes) อยู่ใน hashes (ไม่เกินร้อยกว่าค่า -> ไม่ชนเพดาน parameter)"""
+    col_sql = ", ".join(f"t.{quote_ident(c)}" for c in cols)
+    sql = (
+        f"SELECT TOP ({int(limit)}) {col_sql} FROM {quote_ident(table)} t "
+        f"WHERE {row_hash64_sql(cols)} IN ({', '.join('?' * len(hashes))})"
+    )
+    with conn.cursor() as cur:
+        cur.execute(sql, [int(h) for h in hashes])
+        return read_frame(cur, cols)
 
-    return to_dicts(only_old), to_dicts(only_new), cols_use
+def changed_row_keys(conn_old, table: str, pk_cols: List[str], cols: List[str],
+                     new_ref: str, limit: int = 100) -> List[Dict]:
+    """
+    หา PK ของแถวที่มีทั้งสองฝั่งแต่ค่าต่างกัน ด้วย hash join ฝั่ง server ครั้งเดียว
+    new_ref: ชื่อตาราง NEW ที่อ้างถึงได้จาก conn_old (new_table_ref)
+    """
+    pk_sql = ", ".join(f"t.{quote_ident(c)}" for c in pk_cols)
+    h_sql = row_hash64_sql(cols)
+    src_old = f"SELECT {pk_sql}, {h_sql} AS h FROM {quote_ident(table)} t"
+    src_new = f"SELECT {pk_sql}, {h_sql} AS h FROM {new_ref} t"
+    sel_sql = ", ".join(f"o.{quote_ident(c)}" for c in pk_cols)
+    on_sql = " AND ".join(f"o.{quote_ident(c)} = n.{quote_ident(c)}" for c in pk_cols)
+    sql = (
+        f"SELECT TOP ({int(limit)}) {sel_sql} "
+        f"FROM ({src_old}) o INNER JOIN ({src_new}) n ON {on_sql} WHERE o.h <> n.h"
+    )
+    with conn_old.cursor() as cur:
+        cur.execute(sql)
+        return read_frame(cur, pk_cols).to_dict("records")
+
+def hash_key_diff(conn_old, conn_new, table: str, pk_cols: List[str], cols: List[str],
+                  limit: int = 100) -> Optional[Tuple[List[Dict], List[Dict], List[Dict]]]:
+    """
+    ดึง (PK, hash 64-bit ของแถว) สองฝั่งแล้วจับคู่ตาม PK ใน pandas (ไม่ต้องดึงทุกคอลัมน์ของทั้งตาราง)
+    คืน (PK ที่มีเฉพาะ OLD, PK ที่มีเฉพาะ NEW, PK ที่มีทั้งสองฝั่งแต่ค่าต่าง) อย่างละไม่เกิน limit
+    ค่า PK ซ้ำในฝั่งใดฝั่งหนึ่ง (เช่น NEW ไม่มี constraint แล้วย้ายแถวซ้ำมา) -> จับคู่ตาม PK ไม่ได้ คืน None
+    """
+    h_old, h_new = run_both_sides(q_row_hashes, conn_old, conn_new, table, pk_cols, cols)
+    # ปรับชนิดเฉพาะสำเนาที่ใช้หา codebook (ชนิดร่วมแบบไม่เสียความละเอียด) ส่วน PK ที่คืนยังเป็นค่าเดิม
+    # จากฐาน -> ผูกเป็น parameter ของ q_rows_by_keys ได้ตรงชนิด (ไม่ใช่ 1.0 หรือ '1')
+    k_old, k_new = align_dtypes(h_old[pk_cols], h_new[pk_cols])
+    # PK (หลายคอลัมน์ได้) -> รหัส int64 จาก codebook เดียวกันสองฝั่ง แล้วเทียบด้วย np.isin แทน merge/MultiIndex
+    codes = pd.MultiIndex.from_frame(pd.concat([k_old, k_new], ignore_index=True)).factorize()[0]
+    c_old, c_new = codes[:len(h_old)], codes[len(h_old):]
+    if not (pd.Index(c_old).is_unique and pd.Index(c_new).is_unique):
+        return None
+    in_new = np.isin(c_old, c_new)
+    only_old = h_old.loc[~in_new, pk_cols]
+    only_new = h_new.loc[~np.isin(c_new, c_old), pk_cols]
+    # PK ไม่ซ้ำ -> หา hash ฝั่ง NEW ของแถวที่ตรงกันด้วยรหัส PK
+    h_new_by_code = pd.Series(h_new["__h"].to_numpy(), index=c_new)
+    both = h_old.loc[in_new]
+    changed = both.loc[both["__h"].to_numpy() != h_new_by_code.reindex(c_old[in_new]).to_numpy(), pk_cols]
+    return tuple(df.head(limit).to_dict("records") for df in (only_old, only_new, changed))
+
+def q_rows_by_keys(conn, table: str, cols: List[str], pk_cols: List[str], keys: List[Dict]) -> pd.DataFrame:
+    """ดึงแถวเต็มของ PK ที่กำหนด (keys = [{pk: value}], ไม่เกินร้อยกว่าแถว -> ไม่ชนเพดาน 2100 parameter)"""
+    col_sql = ", ".join(quote_ident(c) for c in cols)
+    key_sql = "(" + " AND ".join(f"{quote_ident(c)} = ?" for c in pk_cols) + ")"
+    sql = f"SELECT {col_sql} FROM {quote_ident(table)} WHERE {' OR '.join([key_sql] * len(keys))}"
+    params = [k[c] for k in keys for c in pk_cols]
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return read_frame(cur, cols)
+
+def column_diffs(df_old: pd.DataFrame, df_new: pd.DataFrame, pk_cols: List[str]) -> pd.DataFrame:
+    """
+    เทียบรายช่องของแถวที่ PK ตรงกันแบบทั้งตารางในครั้งเดียว (ne + stack แทนวนทีละคอลัมน์)
+    คืน long-form: PK..., column, OLD, NEW เฉพาะช่องที่ค่าต่างกัน (ค่าแสดงเป็นข้อความ)
+    """
+    pk_set = set(pk_cols)
+    value_cols = [c for c in df_old.columns if c not in pk_set and c in df_new.columns]
+    a, b = align_dtypes(df_old.set_index(pk_cols)[value_cols], df_new.set_index(pk_cols)[value_cols])
+    a, b = a.align(b, join="inner")
+    # NULL ฝั่งเดียว -> ne ของ dtype แบบ Arrow ได้ <NA> ให้ถือว่าต่าง; NULL ทั้งสองฝั่งถือว่าเท่ากัน
+    mask = (a.ne(b).fillna(True) & ~(a.isna() & b.isna())).stack().astype(bool)
+    # แปลงเป็นข้อความเฉพาะช่องที่ต่างกัน (หลังกรองด้วย mask) ไม่ใช่ทั้งตาราง
+    out = pd.DataFrame({"OLD": a.stack()[mask].astype(str), "NEW": b.stack()[mask].astype(str)})
+    out.index.names = pk_cols + ["column"]
+    return out.reset_index()
+
+def common_dtype(left: pd.Series, right: pd.Series):
+    """
+    ชนิดร่วมของคอลัมน์สองฝั่งที่ไม่เสียความละเอียด (ห้ามแปลง int/decimal เป็น float64:
+    BIGINT, hash 64-bit, DECIMAL(38,x) ที่ต่างกันจะกลายเป็นค่าเดียวกัน) หาไม่ได้ -> str
+    """
+    lt, rt = left.dtype, right.dtype
+    if USE_PYARROW and isinstance(lt, pd.ArrowDtype) and isinstance(rt, pd.ArrowDtype):
+        la, ra = lt.pyarrow_dtype, rt.pyarrow_dtype
+        # int กับ DECIMAL -> Arrow ไม่ promote ให้ จึงมอง int เป็น DECIMAL(19,0) (ครอบ BIGINT ได้ทั้งหมด)
+        if pa.types.is_decimal(la) and pa.types.is_integer(ra):
+            ra = pa.decimal128(19, 0)
+        elif pa.types.is_decimal(ra) and pa.types.is_integer(la):
+            la = pa.decimal128(19, 0)
+        try:
+            target = pa.unify_schemas(
+                [pa.schema([("v", la)]), pa.schema([("v", ra)])], promote_options="permissive"
+            ).field("v").type
+        except (pa.ArrowException, TypeError, ValueError):
+            return str
+        # permissive promote int/decimal + float -> float ซึ่งเสียความละเอียด
+        if pa.types.is_floating(target) and not (pa.types.is_floating(la) and pa.types.is_floating(ra)):
+            return str
+        return pd.ArrowDtype(target)
+    kinds = {lt.kind, rt.kind}
+    if kinds <= {"i", "u"}:
+        return "Int64"
+    if kinds == {"f"}:
+        return "float64"
+    if kinds == {"b"}:
+        return "boolean"
+    return str
+
+def align_dtypes(left: pd.DataFrame, right: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """ให้คอลัมน์ชื่อเดียวกันที่ dtype ไม่ตรงกันเป็นชนิดร่วมที่ไม่เสียความละเอียด (common_dtype)"""
+    mismatch = [c for c in left.columns if c in right.columns and left[c].dtype != right[c].dtype]
+    if not mismatch:
+        return left, right
+    casts = {c: common_dtype(left[c], right[c]) for c in mismatch}
+    try:
+        return left.astype(casts), right.astype(casts)
+    except (TypeError, ValueError, OverflowError):
+        # ค่าจริงแปลงเป็นชนิดร่วมไม่ได้ (เช่น decimal เกิน precision) -> เทียบเป็นข้อความ
+        casts = {c: str for c in mismatch}
+        return left.astype(casts), right.astype(casts)
+
+def frame_row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """hash 64-bit ต่อแถว (คำนวณแบบ vectorized ใน pandas ไม่สร้าง tuple ต่อแถว)"""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def diff_frames(df_old: pd.DataFrame, df_new: pd.DataFrame, cols: List[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    หาแถวที่มีเฉพาะฝั่ง OLD / เฉพาะฝั่ง NEW โดยเทียบ hash 64-bit ต่อแถวด้วย np.isin (ไม่แปลงเป็น string ทั้งแถว)
+    คืนแถวเดิมของแต่ละฝั่ง (ตัดแถวซ้ำ)
+    """
+    # hash ขึ้นกับ dtype (int 1 กับ float 1.0 ได้ค่าต่างกัน) -> ปรับคอลัมน์ที่ dtype ไม่ตรงกันก่อน
+    left, right = align_dtypes(df_old[cols], df_new[cols])
+    h_old = frame_row_hashes(left)
+    h_new = frame_row_hashes(right)
+    keep_old = ~np.isin(h_old, h_new) & ~pd.Series(h_old).duplicated().to_numpy()
+    keep_new = ~np.isin(h_new, h_old) & ~pd.Series(h_new).duplicated().to_numpy()
+    return df_old.loc[keep_old, cols], df_new.loc[keep_new, cols]
+
+def sample_row_diffs(conn_old, conn_new, table: str, cols: List[str],
+                     limit: int = 100) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+    """
+    หาแถวที่ต่างกันเชิงค่าเมื่อไม่มี PK และ NEW อ้างถึงจาก OLD ไม่ได้ (เฉพาะคอลัมน์ร่วม cols ที่ compare_table ดึงมาแล้ว)
+    ดึง hash 64-bit ของทุกแถวสองฝั่งมาหาค่าที่มีฝั่งเดียวด้วย np.setdiff1d
+    แล้วดึงแถวเต็มเฉพาะ hash เหล่านั้น -> ได้แถวที่ต่างจริงทั้งตาราง ไม่ใช่แค่ sample TOP N ที่อาจคนละช่วงกัน
+    """
+    if not cols:
+        return pd.DataFrame(), pd.DataFrame(), []
+
+    h_old, h_new = run_both_sides(q_row_hashes, conn_old, conn_new, table, [], cols)
+    h_old, h_new = h_old["__h"].to_numpy(dtype="int64"), h_new["__h"].to_numpy(dtype="int64")
+    only_old = np.setdiff1d(h_old, h_new)[:limit].tolist()
+    only_new = np.setdiff1d(h_new, h_old)[:limit].tolist()
+    fut_old = _SIDE_POOL.submit(q_rows_by_hashes, conn_old, table, cols, only_old, limit) if only_old else None
+    fut_new = _SIDE_POOL.submit(q_rows_by_hashes, conn_new, table, cols, only_new, limit) if only_new else None
+    rows_old = fut_old.result() if fut_old else pd.DataFrame(columns=cols)
+    rows_new = fut_new.result() if fut_new else pd.DataFrame(columns=cols)
+    return rows_old, rows_new, cols
+
+def iter_compare_tables(conn_str_old, conn_str_new,
+                        tables: List[str], **kwargs) -> Iterator[Tuple[str, dict]]:
+    """
+    รัน compare_table หลายตารางพร้อมกันด้วย thread pool (งานรอ I/O ฝั่ง SQL Server เป็นหลัก)
+    แล้ว yield (table, ผล) ตามลำดับที่เสร็จ เพื่อให้ UI แสดงผลตารางที่เสร็จก่อนได้ทันที
+    connection ของ pyodbc ใช้ข้าม thread พร้อมกันไม่ได้ -> แต่ละ worker ยืมคู่ (OLD, NEW) ของตัวเอง
+    เปิดใหม่ทุกคู่ (pooling ของ pyodbc ทำให้ถูก) เพราะ UI ยังใช้ connection ของ session ระหว่างรอผล
+    แต่ละคู่เปิดใน worker ตอนใช้ครั้งแรก -> handshake ของทุกคู่เกิดพร้อมกัน ไม่ต้องรอเปิดทีละคู่ก่อนเริ่มงาน
+    """
+    n_workers = max(1, min(MAX_COMPARE_WORKERS, len(tables)))
+    pairs: "queue.Queue[Optional[Tuple]]" = queue.Queue()
+    opened = []
+    for _ in range(n_workers):
+        pairs.put(None)
+    try:
+        def run_one(table: str) -> dict:
+            pair = pairs.get()
+            if pair is None:
+                try:
+                    c_old = open_conn(conn_str_old)
+                    opened.append(c_old)
+                    c_new = open_conn(conn_str_new)
+                    opened.append(c_new)
+                except Exception as e:
+                    # เปิดไม่ได้ -> เป็นผล error ของตารางนี้ (แบบเดียวกับ compare_table) ไม่ทิ้งผลของตารางอื่นที่เสร็จแล้ว
+                    pairs.put(None)
+                    res = new_compare_result(table)
+                    res["ok"] = False
+                    res["messages"].append(f"เชื่อมต่อฐานข้อมูลไม่ได้: {e}")
+                    return res
+                pair = (c_old, c_new)
+            c_old, c_new = pair
+            try:
+                return compare_table(c_old, c_new, table, **kwargs)
+            finally:
+                pairs.put((c_old, c_new))
+
+        with ThreadPoolExecutor(max_workers=n_workers) as ex:
+            futures = {ex.submit(run_one, table): table for table in tables}
+            for fut in as_completed(futures):
+                yield futures[fut], fut.result()
+    finally:
+        for conn in opened:
+            close_quietly(conn)
 
 # ================================
 # Data Preview
 # ================================
+def recent_partition_where(conn, table: str, where: Optional[str], recent_days: Optional[int]) -> Optional[str]:
+    """WHERE ที่ใช้จริงของ sample: ไม่ได้ระบุ WHERE + ตาราง partition ด้วยคอลัมน์วันที่ -> กรอง N วันล่าสุดบนคอลัมน์ partition"""
+    if recent_days and not (where and where.strip()):
+        part = q_partition_column(conn, table)
+        if part and part[1] in DATE_TYPES:
+            return f"{quote_ident(part[0])} >= DATEADD(day, -{int(recent_days)}, SYSDATETIME())"
+    return where
+
 def fetch_table_sample(conn, table: str,
                        columns: Optional[List[str]] = None,
                        where: Optional[str] = None,
                        order_by: Optional[str] = None,
-                       top: int = 200) -> pd.DataFrame:
+                       top: int = 200,
+                       recent_days: Optional[int] = None,
+                       nolock: bool = True) -> pd.DataFrame:
+    """
+    nolock: ใส่ WITH (NOLOCK) สำหรับ preview (เร็ว ไม่รอ lock แต่อาจเห็นแถวซ้ำ/ยังไม่ commit)
+    recent_days: ถ้าตารางถูก partition ด้วยคอลัมน์วันที่และไม่ได้ระบุ WHERE
+    -> กรองเฉพาะ N วันล่าสุดบนคอลัมน์ partition ให้ SQL Server ตัด partition เก่าทิ้ง (partition elimination)
+    """
     cols_meta = q_columns(conn, table)
     all_cols = [c for c, _ in cols_meta]
     if not all_cols:
         return pd.DataFrame()
 
-    use_cols = [c for c in (columns or all_cols) if c in all_cols] or all_cols
+    all_set = set(all_cols)
+    use_cols = [c for c in (columns or all_cols) if c in all_set] or all_cols
     col_sql = ", ".join(quote_ident(c) for c in use_cols)
+    where = recent_partition_where(conn, table, where, recent_days)
     where_sql = f" WHERE {where} " if where and where.strip() else ""
     order_sql = f" ORDER BY {order_by} " if order_by and order_by.strip() else ""
 
-    sql = f"SELECT TOP ({top}) {col_sql} FROM {quote_ident(table)} WITH (NOLOCK){where_sql}{order_sql}"
+    hint_sql = " WITH (NOLOCK)" if nolock else ""
+    # TOP เป็น parameter -> เปลี่ยนจำนวนแถวแล้ว SQL Server ยังใช้ plan เดิมของข้อความ query เดียวกันได้
+    sql = f"SELECT TOP (?) {col_sql} FROM {quote_ident(table)}{hint_sql}{where_sql}{order_sql}"
 
     with conn.cursor() as cur:
-        cur.execute(sql)
-        rows = cur.fetchall()
-        df = pd.DataFrame.from_records(rows, columns=use_cols)
+        cur.execute(sql, (int(top),))
+        return read_frame(cur, use_cols)
+
+def session_table_sample(which: str, conn, cfg_sig: str, table: str, *args, max_age: float = 0) -> pd.DataFrame:
+    """
+    fetch_table_sample ที่จำ sample ล่าสุดของแต่ละฝั่ง ('old' | 'new') ไว้ใน st.session_state
+    ใช้ซ้ำได้ถ้าพารามิเตอร์เหมือนเดิมและอายุไม่เกิน max_age วินาที (0 = ดึงใหม่เสมอแล้วจำไว้)
+    -> ปุ่มหาแถวที่ต่างใช้ sample ที่เพิ่งแสดงไปได้เลย ไม่ต้อง query ซ้ำ
+    """
+    cache = st.session_state.setdefault("preview_samples", {})
+    key = (cfg_sig, table, repr(args))
+    entry = cache.get(which)
+    now = time.monotonic()
+    if entry is not None and entry[0] == key and now - entry[1] <= max_age:
+        return entry[2]
+    df = fetch_table_sample(conn, table, *args)
+    cache[which] = (key, now, df)
     return df
 
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    CSV (utf-8-sig ให้ Excel อ่านภาษาไทยได้)
+    ส่งให้ st.download_button เป็น partial(to_csv_bytes, df) -> encode ตอนกดดาวน์โหลดเท่านั้น ไม่ใช่ทุกตารางทุกครั้งที่ render
+    """
+    return df.to_csv(index=False).encode("utf-8-sig")
+
 # ================================
 # UI: Config Editor (Popup / Expander)
 # ================================
@@ -275,8 +1065,11 @@ def render_config_form(cfg: dict) -> dict:
     driver = st.text_input("ODBC Driver", value=cfg.get("driver", "ODBC Driver 17 for SQL Server"), key="cfg_driver_txt")
     encrypt = st.checkbox("Encrypt", value=cfg.get("encrypt", True), key="cfg_encrypt_chk")
     trust = st.checkbox("Trust Server Certificate", value=cfg.get("trust_server_cert", True), key="cfg_trust_chk")
+    linked = st.text_input("Linked server (บน OLD ที่ชี้ไป NEW, เว้นว่างได้)", value=cfg.get("linked_server_name", ""),
+                           key="cfg_linked_server_txt")
 
-    cfg_new = {**cfg, **cfg_editor, "driver": driver, "encrypt": encrypt, "trust_server_cert": trust}
+    cfg_new = {**cfg, **cfg_editor, "driver": driver, "encrypt": encrypt, "trust_server_cert": trust,
+               "linked_server_name": linked.strip()}
     return cfg_new
 
 def config_editor_ui(cfg: dict):
@@ -351,199 +1144,215 @@ def config_editor_ui(cfg: dict):
                     st.rerun()
 
 # ================================
-# Streamlit UI
+# UI: Compare Result
 # ================================
-st.set_page_config(page_title="DB Compare (Old vs New)", page_icon="🧪", layout="wide")
-st.title("🧪 เปรียบเทียบข้อมูล: ฐานเก่า vs ฐานใหม่")
-
-cfg = load_config()
-tables = load_tables()
-
-# ---- CONFIG POPUP / EXPANDER ----
-config_editor_ui(cfg)
-
-st.divider()
-
-# ---- Connection Status
-st.subheader("สถานะการเชื่อมต่อ")
-conn_str_old = build_conn_str(cfg, "old_db")
-conn_str_new = build_conn_str(cfg, "new_db")
-
-col_status, col_edit_tables = st.columns([1, 1])
-with col_status:
-    ok_old = ok_new = False
-    try:
-        with open_conn(conn_str_old):
-            st.success("OLD: เชื่อมต่อได้")
-            ok_old = True
-    except Exception as e:
-        st.error(f"OLD: เชื่อมต่อไม่ได้ - {e}")
-
-    try:
-        with open_conn(conn_str_new):
-            st.success("NEW: เชื่อมต่อได้")
-            ok_new = True
-    except Exception as e:
-        st.error(f"NEW: เชื่อมต่อไม่ได้ - {e}")
-
-with col_edit_tables:
-    st.subheader("จัดการ tables.json")
-    tables_editor = st.text_area("แก้ไขรายการตาราง", value=json.dumps(tables, ensure_ascii=False, indent=2), height=200, key="tables_editor")
-    if st.button("💾 บันทึก tables.json", key="btn_save_tables"):
-        try:
-            new_tbls = json.loads(tables_editor)
-            if save_json(TABLES_PATH, new_tbls):
-                st.success("บันทึกสำเร็จ")
-                st.experimental_rerun()
-        except Exception as e:
-            st.error(f"รูปแบบ JSON ไม่ถูกต้อง: {e}")
-
-st.divider()
-
-# ---- Compare Section
-st.header("🔍 Compare (Schema/Rows/Checksum)")
-
-tab_choice = st.radio("เลือกหมวด", options=["master", "transaction"], horizontal=True, key="cmp_cat")
-options = tables.get(tab_choice, [])
-selected = st.multiselect("เลือกตารางที่ต้องการเปรียบเทียบ", options=options, default=options, key="cmp_tables")
-
-if st.button("เริ่มเปรียบเทียบ", disabled=not (ok_old and ok_new), key="btn_compare"):
-    if not selected:
-        st.info("กรุณาเลือกอย่างน้อย 1 ตาราง")
+def render_compare_result(tname: str, res: dict, conn_old, conn_new, cfg_sig: str):
+    """แสดงผล compare_table ของหนึ่งตาราง (เรียกใน container ของตารางนั้นเมื่อผลเสร็จ)"""
+    st.markdown(f"### 📄 ตาราง: `{tname}`")
+
+    if res["ok"] and res["schema_equal"]:
+        status = "✅ เหมือนกันทั้งหมด"
+    elif res["ok"] and not res["schema_equal"]:
+        status = "🟡 โครงสร้างต่างกันเล็กน้อย แต่ข้อมูลอาจเหมือน"
     else:
-        with open_conn(conn_str_old) as conn_old, open_conn(conn_str_new) as conn_new:
-            for tname in selected:
-                st.markdown(f"### 📄 ตาราง: `{tname}`")
-                res = compare_table(conn_old, conn_new, tname)
-
-                if res["ok"] and res["schema_equal"]:
-                    status = "✅ เหมือนกันทั้งหมด"
-                elif res["ok"] and not res["schema_equal"]:
-                    status = "🟡 โครงสร้างต่างกันเล็กน้อย แต่ข้อมูลอาจเหมือน"
-                else:
-                    status = "❌ พบความแตกต่าง"
-
-                st.write(f"ผลการเปรียบเทียบ: **{status}**")
-                st.write(
-                    f"- Schema equal: **{res['schema_equal']}**  \n"
-                    f"- RowCount: OLD = **{res['rowcount_old']}**, NEW = **{res['rowcount_new']}**  \n"
-                    f"- Checksum: OLD = **{res['checksum_old']}**, NEW = **{res['checksum_new']}**"
-                )
-                if res["messages"]:
-                    with st.expander("รายละเอียด / คำเตือน", expanded=False):
-                        for m in res["messages"]:
-                            st.write(f"- {m}")
-
-                if not res["ok"]:
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        st.subheader("🔻 อยู่ใน OLD แต่ไม่อยู่ใน NEW (sample)")
-                        if res["only_in_old"]:
-                            df_only_old = pd.DataFrame(res["only_in_old"])
-                            st.dataframe(df_only_old, use_container_width=True, key=f"df_only_old_{tname}")
-                            csv1 = df_only_old.to_csv(index=False).encode("utf-8-sig")
-                            st.download_button("⬇️ CSV (Only in OLD - sample)", data=csv1,
-                                               file_name=f"{tname}_only_in_OLD_sample.csv", mime="text/csv",
-                                               key=f"dl_only_old_{tname}")
-                        else:
-                            st.caption("— ไม่มีตัวอย่าง —")
-                    with c2:
-                        st.subheader("🔺 อยู่ใน NEW แต่ไม่อยู่ใน OLD (sample)")
-                        if res["only_in_new"]:
-                            df_only_new = pd.DataFrame(res["only_in_new"])
-                            st.dataframe(df_only_new, use_container_width=True, key=f"df_only_new_{tname}")
-                            csv2 = df_only_new.to_csv(index=False).encode("utf-8-sig")
-                            st.download_button("⬇️ CSV (Only in NEW - sample)", data=csv2,
-                                               file_name=f"{tname}_only_in_NEW_sample.csv", mime="text/csv",
-                                               key=f"dl_only_new_{tname}")
-                        else:
-                            st.caption("— ไม่มีตัวอย่าง —")
-
-                # ===== ตัวอย่างข้อมูลแบบเคียงข้าง (OLD / NEW) =====
-                with st.expander("👀 ตัวอย่างข้อมูล (OLD / NEW)", expanded=False):
-                    top_sample = st.number_input(
-                        f"จำนวนแถวตัวอย่างสำหรับ {tname}",
-                        min_value=1, max_value=10000, value=50, step=50,
-                        key=f"top_sample_{tname}"
+        status = "❌ พบความแตกต่าง"
+
+    st.write(f"ผลการเปรียบเทียบ: **{status}**")
+    st.write(
+        f"- Schema equal: **{res['schema_equal']}**  \n"
+        f"- RowCount: OLD = **{res['rowcount_old']}**, NEW = **{res['rowcount_new']}**  \n"
+        f"- Checksum: OLD = **{res['checksum_old'] if res['checksum_old'] is not None else '-'}**, "
+        f"NEW = **{res['checksum_new'] if res['checksum_new'] is not None else '-'}**"
+    )
+    if res["messages"]:
+        with st.expander("รายละเอียด / คำเตือน", expanded=False):
+            for m in res["messages"]:
+                st.write(f"- {m}")
+
+    if not res["ok"]:
+        if res["pk_cols"]:
+            st.caption(f"เทียบตาม PK ({', '.join(res['pk_cols'])}): ‘อยู่ฝั่งเดียว’ = PK ที่ไม่มีอีกฝั่ง; "
+                       "แถวที่ PK ตรงกันแต่ค่าต่างแสดงแยกด้านล่าง")
+        else:
+            st.caption("ไม่มี PK: เทียบทั้งแถว -> แถวที่ค่าต่างจะปรากฏเป็น ‘อยู่ฝั่งเดียว’ ทั้งสองฝั่ง")
+        c1, c2 = st.columns(2)
+        with c1:
+            st.subheader("🔻 อยู่ใน OLD แต่ไม่อยู่ใน NEW (sample)")
+            if not res["only_in_old"].empty:
+                df_only_old = res["only_in_old"]
+                st.dataframe(df_only_old, use_container_width=True, key=f"df_only_old_{tname}")
+                st.download_button("⬇️ CSV (Only in OLD - sample)", data=partial(to_csv_bytes, df_only_old),
+                                   file_name=f"{tname}_only_in_OLD_sample.csv", mime="text/csv",
+                                   key=f"dl_only_old_{tname}")
+            else:
+                st.caption("— ไม่มีตัวอย่าง —")
+        with c2:
+            st.subheader("🔺 อยู่ใน NEW แต่ไม่อยู่ใน OLD (sample)")
+            if not res["only_in_new"].empty:
+                df_only_new = res["only_in_new"]
+                st.dataframe(df_only_new, use_container_width=True, key=f"df_only_new_{tname}")
+                st.download_button("⬇️ CSV (Only in NEW - sample)", data=partial(to_csv_bytes, df_only_new),
+                                   file_name=f"{tname}_only_in_NEW_sample.csv", mime="text/csv",
+                                   key=f"dl_only_new_{tname}")
+            else:
+                st.caption("— ไม่มีตัวอย่าง —")
+
+        if res["changed_keys"]:
+            st.subheader(f"🔁 แถวที่ PK ตรงกันแต่ค่าต่างกัน (PK: {', '.join(res['pk_cols'])})")
+            df_changed = pd.DataFrame(res["changed_keys"])
+            st.dataframe(df_changed, use_container_width=True, key=f"df_changed_{tname}")
+            st.download_button("⬇️ CSV (Changed keys)", data=partial(to_csv_bytes, df_changed),
+                               file_name=f"{tname}_changed_keys.csv", mime="text/csv",
+                               key=f"dl_changed_{tname}")
+            if not res["changed_cells"].empty:
+                with st.expander("ช่องที่ค่าต่างกัน (OLD → NEW)", expanded=False):
+                    df_cells = res["changed_cells"]
+                    st.dataframe(df_cells, use_container_width=True, key=f"df_changed_cells_{tname}")
+                    st.download_button("⬇️ CSV (Changed cells)", data=partial(to_csv_bytes, df_cells),
+                                       file_name=f"{tname}_changed_cells.csv", mime="text/csv",
+                                       key=f"dl_changed_cells_{tname}")
+
+    # ===== ตัวอย่างข้อมูลแบบเคียงข้าง (OLD / NEW) =====
+    with st.expander("👀 ตัวอย่างข้อมูล (OLD / NEW)", expanded=False):
+        top_sample = st.number_input(
+            f"จำนวนแถวตัวอย่างสำหรับ {tname}",
+            min_value=1, max_value=10000, value=50, step=50,
+            key=f"top_sample_{tname}"
+        )
+        # ดึงตัวอย่างเฉพาะเมื่อผู้ใช้ขอ (ไม่เช่นนั้นทุกตารางในผล compare จะ query สองฝั่งทุกครั้งที่ render)
+        if st.checkbox("โหลดตัวอย่างข้อมูล", value=False, key=f"load_sample_{tname}"):
+            try:
+                cols_common = session_common_columns(conn_old, conn_new, tname, cfg_sig)
+            except Exception as e:
+                cols_common = []
+                st.error(f"ดึงคอลัมน์ไม่สำเร็จ: {e}")
+
+            if not cols_common:
+                st.warning("ไม่พบคอลัมน์ร่วมระหว่าง OLD/NEW — ไม่สามารถแสดงตัวอย่างข้อมูลได้")
+            else:
+                cfl, cfr = st.columns([2, 1])
+                with cfl:
+                    where_quick = st.text_input(
+                        "WHERE (ไม่ต้องพิมพ์คำว่า WHERE)",
+                        placeholder="เช่น IsActive = 1 AND Code LIKE 'TH%'",
+                        key=f"where_sample_{tname}"
                     )
+                    order_quick = st.text_input(
+                        "ORDER BY",
+                        placeholder="เช่น Code, Name",
+                        key=f"order_sample_{tname}"
+                    )
+                with cfr:
+                    st.caption("TIP: ปล่อยว่างได้เพื่อความเร็ว")
+
+                col_old_prev, col_new_prev = st.columns(2)
+                with col_old_prev:
+                    st.write("**OLD**")
                     try:
-                        cols_old = [c for c, _ in q_columns(conn_old, tname)]
-                        cols_new = [c for c, _ in q_columns(conn_new, tname)]
-                        cols_common = [c for c in cols_old if c in cols_new]
+                        df_old_prev = fetch_table_sample(
+                            conn_old, tname, columns=cols_common,
+                            where=where_quick, order_by=order_quick, top=top_sample
+                        )
+                        st.dataframe(df_old_prev, use_container_width=True, key=f"df_old_prev_{tname}")
+                        st.download_button(
+                            "⬇️ ดาวน์โหลด CSV (OLD - sample)",
+                            data=partial(to_csv_bytes, df_old_prev),
+                            file_name=f"{tname}_OLD_sample.csv",
+                            mime="text/csv",
+                            key=f"dl_old_prev_{tname}"
+                        )
                     except Exception as e:
-                        cols_common = []
-                        st.error(f"ดึงคอลัมน์ไม่สำเร็จ: {e}")
-
-                    if not cols_common:
-                        st.warning("ไม่พบคอลัมน์ร่วมระหว่าง OLD/NEW — ไม่สามารถแสดงตัวอย่างข้อมูลได้")
-                    else:
-                        cfl, cfr = st.columns([2, 1])
-                        with cfl:
-                            where_quick = st.text_input(
-                                "WHERE (ไม่ต้องพิมพ์คำว่า WHERE)",
-                                placeholder="เช่น IsActive = 1 AND Code LIKE 'TH%'",
-                                key=f"where_sample_{tname}"
-                            )
-                            order_quick = st.text_input(
-                                "ORDER BY",
-                                placeholder="เช่น Code, Name",
-                                key=f"order_sample_{tname}"
-                            )
-                        with cfr:
-                            st.caption("TIP: ปล่อยว่างได้เพื่อความเร็ว")
-
-                        col_old_prev, col_new_prev = st.columns(2)
-                        with col_old_prev:
-                            st.write("**OLD**")
-                            try:
-                                df_old_prev = fetch_table_sample(
-                                    conn_old, tname, columns=cols_common,
-                                    where=where_quick, order_by=order_quick, top=top_sample
-                                )
-                                st.dataframe(df_old_prev, use_container_width=True, key=f"df_old_prev_{tname}")
-                                st.download_button(
-                                    "⬇️ ดาวน์โหลด CSV (OLD - sample)",
-                                    data=df_old_prev.to_csv(index=False).encode("utf-8-sig"),
-                                    file_name=f"{tname}_OLD_sample.csv",
-                                    mime="text/csv",
-                                    key=f"dl_old_prev_{tname}"
-                                )
-                            except Exception as e:
-                                st.error(f"ดึงข้อมูล OLD ไม่สำเร็จ: {e}")
-
-                        with col_new_prev:
-                            st.write("**NEW**")
-                            try:
-                                df_new_prev = fetch_table_sample(
-                                    conn_new, tname, columns=cols_common,
-                                    where=where_quick, order_by=order_quick, top=top_sample
-                                )
-                                st.dataframe(df_new_prev, use_container_width=True, key=f"df_new_prev_{tname}")
-                                st.download_button(
-                                    "⬇️ ดาวน์โหลด CSV (NEW - sample)",
-                                    data=df_new_prev.to_csv(index=False).encode("utf-8-sig"),
-                                    file_name=f"{tname}_NEW_sample.csv",
-                                    mime="text/csv",
-                                    key=f"dl_new_prev_{tname}"
-                                )
-                            except Exception as e:
-                                st.error(f"ดึงข้อมูล NEW ไม่สำเร็จ: {e}")
+                        st.error(f"ดึงข้อมูล OLD ไม่สำเร็จ: {e}")
 
-                st.divider()
+                with col_new_prev:
+                    st.write("**NEW**")
+                    try:
+                        df_new_prev = fetch_table_sample(
+                            conn_new, tname, columns=cols_common,
+                            where=where_quick, order_by=order_quick, top=top_sample
+                        )
+                        st.dataframe(df_new_prev, use_container_width=True, key=f"df_new_prev_{tname}")
+                        st.download_button(
+                            "⬇️ ดาวน์โหลด CSV (NEW - sample)",
+                            data=partial(to_csv_bytes, df_new_prev),
+                            file_name=f"{tname}_NEW_sample.csv",
+                            mime="text/csv",
+                            key=f"dl_new_prev_{tname}"
+                        )
+                    except Exception as e:
+                        st.error(f"ดึงข้อมูล NEW ไม่สำเร็จ: {e}")
 
-st.divider()
+    st.divider()
 
-# ---- Data Preview Section
-st.header("👀 ดูข้อมูลตาราง (Data Preview)")
-prev_cat = st.radio("เลือกหมวด", options=["master", "transaction"], horizontal=True, key="preview_cat")
-prev_options = tables.get(prev_cat, [])
-tbl_preview = st.selectbox("เลือกตาราง", options=prev_options, index=0 if prev_options else None, key="preview_tbl")
+# ================================
+# UI: Compare
+# ================================
+@st.fragment
+def compare_section(tables: dict, conn_str_old, conn_str_new, ok_old: bool, ok_new: bool,
+                    new_prefix: Optional[str], cfg_sig: str):
+    """
+    ตัวเลือก/ปุ่มเปรียบเทียบและผลที่จำไว้ เป็น st.fragment -> ติ๊ก ‘โหลดตัวอย่างข้อมูล’ หรือเปลี่ยนตัวเลือก
+    rerun เฉพาะส่วนนี้ ไม่ต้องตรวจ connection / วาด Data Preview ทั้งหน้าใหม่
+    """
+    tab_choice = st.radio("เลือกหมวด", options=["master", "transaction"], horizontal=True, key="cmp_cat")
+    options = tables.get(tab_choice, [])
+    selected = st.multiselect("เลือกตารางที่ต้องการเปรียบเทียบ", options=options, default=options, key="cmp_tables")
+    fast_rowcount = st.checkbox("นับแถวจาก metadata (แทน COUNT_BIG)", value=False, key="cmp_fast_rowcount",
+                                help="COUNT_BIG นับไปพร้อม checksum ใน scan เดียวกันอยู่แล้ว — "
+                                     "เปิดเพื่ออ่าน sys.dm_db_partition_stats แทน (ค่าอาจคลาดได้ระหว่างมีการเขียน) "
+                                     "และข้าม checksum ของตารางที่จำนวนแถวต่างกันแล้ว")
+
+    if st.button("เริ่มเปรียบเทียบ", disabled=not (ok_old and ok_new), key="btn_compare"):
+        if not selected:
+            st.info("กรุณาเลือกอย่างน้อย 1 ตาราง")
+        else:
+            conn_old = get_conn("old", conn_str_old)
+            conn_new = get_conn("new", conn_str_new)
+            run_both_sides(prefetch_columns, conn_old, conn_new, selected)
+            status = st.status(f"กำลังเปรียบเทียบ {len(selected)} ตาราง...", expanded=False)
+            # จองที่ตามลำดับตารางที่เลือกไว้ก่อน แล้วเติมผลของตารางที่เสร็จก่อนทันที (ไม่ต้องรอตารางที่ช้าที่สุด)
+            slots = {tname: st.container() for tname in selected}
+            results = iter_compare_tables(conn_str_old, conn_str_new, selected,
+                                          new_prefix=new_prefix, exact_rowcount=not fast_rowcount)
+            done_results = {}
+            for done, (tname, res) in enumerate(results, start=1):
+                status.update(label=f"เปรียบเทียบแล้ว {done}/{len(selected)} ตาราง (ล่าสุด: {tname})")
+                with slots[tname]:
+                    render_compare_result(tname, res, conn_old, conn_new, cfg_sig)
+                done_results[tname] = res
+            status.update(label=f"เปรียบเทียบครบ {len(selected)} ตาราง", state="complete")
+            # จำผลไว้ให้ rerun ถัดไป (เช่น ติ๊กโหลดตัวอย่างข้อมูล) แสดงผลเดิมได้โดยไม่ต้องเปรียบเทียบใหม่
+            st.session_state["compare_results"] = (cfg_sig, [(t, done_results[t]) for t in selected])
+    elif ok_old and ok_new:
+        saved = st.session_state.get("compare_results")
+        if saved and saved[0] == cfg_sig:
+            conn_old = get_conn("old", conn_str_old)
+            conn_new = get_conn("new", conn_str_new)
+            st.caption("ผลจากการกด ‘เริ่มเปรียบเทียบ’ ครั้งล่าสุด — กดอีกครั้งเพื่อเปรียบเทียบใหม่")
+            for tname, res in saved[1]:
+                render_compare_result(tname, res, conn_old, conn_new, cfg_sig)
 
-if tbl_preview and ok_old and ok_new:
-    with open_conn(conn_str_old) as conn_old, open_conn(conn_str_new) as conn_new:
-        cols_old = [c for c, _ in q_columns(conn_old, tbl_preview)]
-        cols_new = [c for c, _ in q_columns(conn_new, tbl_preview)]
-        common_cols = [c for c in cols_old if c in cols_new] or (cols_old or cols_new)
+# ================================
+# UI: Data Preview
+# ================================
+@st.fragment
+def data_preview_section(cfg: dict, tables: dict, conn_str_old, conn_str_new,
+                         ok_old: bool, ok_new: bool, cfg_sig: str):
+    """
+    ส่วนดูข้อมูลตาราง เป็น st.fragment -> เปลี่ยนตัวเลือกในส่วนนี้ rerun เฉพาะฟังก์ชันนี้
+    ไม่ต้องตรวจ connection / วาดผล compare ทั้งหน้าใหม่ทุกครั้งที่พิมพ์ WHERE หรือกดดึงข้อมูล
+    """
+    st.header("👀 ดูข้อมูลตาราง (Data Preview)")
+    prev_cat = st.radio("เลือกหมวด", options=["master", "transaction"], horizontal=True, key="preview_cat")
+    prev_options = tables.get(prev_cat, [])
+    tbl_preview = st.selectbox("เลือกตาราง", options=prev_options, index=0 if prev_options else None, key="preview_tbl")
+
+    if tbl_preview and ok_old and ok_new:
+        conn_old = get_conn("old", conn_str_old)
+        conn_new = get_conn("new", conn_str_new)
+        common_cols = session_common_columns(conn_old, conn_new, tbl_preview, cfg_sig)
+        if not common_cols:
+            common_cols = [c for c, _ in q_columns(conn_old, tbl_preview)] or [c for c, _ in q_columns(conn_new, tbl_preview)]
 
         st.subheader(f"ตาราง: `{tbl_preview}`")
         with st.expander("🧩 ตั้งค่าการดึงข้อมูล", expanded=True):
@@ -560,6 +1369,12 @@ if tbl_preview and ok_old and ok_new:
             with c_r:
                 top_n = st.number_input("TOP (จำนวนแถว)", min_value=1, max_value=100000, value=200, step=50, key="preview_topn")
                 st.caption("แนะนำ 50–1000 เพื่อแสดงผลเร็ว")
+                recent_days = st.number_input(
+                    "เฉพาะ N วันล่าสุด (0 = ทั้งหมด)", min_value=0, max_value=3650, value=0, step=7, key="preview_recent_days",
+                    help="ใช้เมื่อตารางถูก partition ด้วยคอลัมน์วันที่และไม่ได้ระบุ WHERE — อ่านเฉพาะ partition ล่าสุด"
+                )
+                preview_nolock = st.checkbox("อ่านแบบ NOLOCK", value=True, key="preview_nolock",
+                                             help="เร็วและไม่รอ lock แต่อาจเห็นข้อมูลที่ยังไม่ commit หรือแถวซ้ำ")
 
             run_preview = st.button("📄 แสดงข้อมูล (OLD/NEW)", key="btn_run_preview")
 
@@ -570,11 +1385,12 @@ if tbl_preview and ok_old and ok_new:
             with col_old:
                 st.write("**OLD**")
                 try:
-                    df_old = fetch_table_sample(conn_old, tbl_preview, use_cols, where_clause, order_by, top_n)
+                    df_old = session_table_sample("old", conn_old, cfg_sig, tbl_preview, use_cols, where_clause,
+                                                  order_by, top_n, recent_days, preview_nolock)
                     st.dataframe(df_old, use_container_width=True, key="df_prev_old")
                     st.download_button(
                         "⬇️ ดาวน์โหลด CSV (OLD)",
-                        data=df_old.to_csv(index=False).encode("utf-8-sig"),
+                        data=partial(to_csv_bytes, df_old),
                         file_name=f"{tbl_preview}_OLD.csv",
                         mime="text/csv",
                         key="dl_prev_old"
@@ -585,11 +1401,12 @@ if tbl_preview and ok_old and ok_new:
             with col_new:
                 st.write("**NEW**")
                 try:
-                    df_new = fetch_table_sample(conn_new, tbl_preview, use_cols, where_clause, order_by, top_n)
+                    df_new = session_table_sample("new", conn_new, cfg_sig, tbl_preview, use_cols, where_clause,
+                                                  order_by, top_n, recent_days, preview_nolock)
                     st.dataframe(df_new, use_container_width=True, key="df_prev_new")
                     st.download_button(
                         "⬇️ ดาวน์โหลด CSV (NEW)",
-                        data=df_new.to_csv(index=False).encode("utf-8-sig"),
+                        data=partial(to_csv_bytes, df_new),
                         file_name=f"{tbl_preview}_NEW.csv",
                         mime="text/csv",
                         key="dl_prev_new"
@@ -602,56 +1419,139 @@ if tbl_preview and ok_old and ok_new:
             if st.button("🔍 หาแถวที่ไม่ตรงกัน (from sample)", key="btn_quickdiff"):
                 try:
                     use_cols = picked_cols or common_cols
-                    df_old = fetch_table_sample(conn_old, tbl_preview, use_cols, where_clause, order_by, top_n)
-                    df_new = fetch_table_sample(conn_new, tbl_preview, use_cols, where_clause, order_by, top_n)
+                    new_ref = new_table_ref(cfg, tbl_preview)
+                    if new_ref:
+                        # NEW อ้างถึงได้จาก OLD (server เดียวกัน/linked server) -> ให้ SQL Server หาแถวที่ต่าง ไม่ต้องดึง sample มาเทียบ
+                        common_set = set(common_cols) - set(q_clr_columns(conn_old, tbl_preview))
+                        cols_use = [c for c in use_cols if c in common_set]
+                        if len(cols_use) < len([c for c in use_cols if c in common_cols]):
+                            st.caption("ไม่ได้เทียบคอลัมน์ชนิด CLR (geography/geometry/hierarchyid)")
+                        if cols_use:
+                            old_ref = quote_ident(tbl_preview)
+                            sample_args = (where_clause, order_by, top_n, recent_days)
+                            # NEW ผ่าน linked server -> ห้ามใส่ NOLOCK ฝั่ง NEW (table hint ใช้กับ remote object ไม่ได้)
+                            nolock_new = preview_nolock and not (cfg.get("linked_server_name") or "").strip()
+                            df1 = q_sample_except(conn_old, tbl_preview, old_ref, new_ref, cols_use, *sample_args,
+                                                  nolock_src=preview_nolock, nolock_dst=nolock_new)
+                            df2 = q_sample_except(conn_old, tbl_preview, new_ref, old_ref, cols_use, *sample_args,
+                                                  nolock_src=nolock_new, nolock_dst=preview_nolock)
+                    else:
+                        # ใช้ sample ที่เพิ่งแสดงด้วยการตั้งค่าเดียวกันถ้ายังไม่เก่าเกิน PREVIEW_SAMPLE_MAX_AGE
+                        sample_args = (use_cols, where_clause, order_by, top_n, recent_days, preview_nolock)
+                        df_old = session_table_sample("old", conn_old, cfg_sig, tbl_preview, *sample_args,
+                                                      max_age=PREVIEW_SAMPLE_MAX_AGE)
+                        df_new = session_table_sample("new", conn_new, cfg_sig, tbl_preview, *sample_args,
+                                                      max_age=PREVIEW_SAMPLE_MAX_AGE)
+                        cols_use = [c for c in use_cols if c in df_old.columns and c in df_new.columns]
+                        if cols_use:
+                            df1, df2 = diff_frames(df_old, df_new, cols_use)
 
-                    cols_use = [c for c in use_cols if c in df_old.columns and c in df_new.columns]
                     if not cols_use:
                         st.warning("ไม่มีคอลัมน์ร่วมสำหรับเทียบ")
                     else:
-                        set_old = {tuple(str(x) for x in row) for row in df_old[cols_use].itertuples(index=False, name=None)}
-                        set_new = {tuple(str(x) for x in row) for row in df_new[cols_use].itertuples(index=False, name=None)}
-                        only_old = set_old - set_new
-                        only_new = set_new - set_old
-
-                        def tuples_to_df(tset):
-                            return pd.DataFrame([dict(zip(cols_use, t)) for t in list(tset)])
-
                         c1, c2 = st.columns(2)
                         with c1:
                             st.write("🔻 อยู่ใน OLD แต่ไม่อยู่ใน NEW (จาก sample)")
-                            df1 = tuples_to_df(only_old)
                             st.dataframe(df1, use_container_width=True, key="df_prev_only_old")
                             if not df1.empty:
                                 st.download_button(
                                     "⬇️ CSV (Only in OLD - sample)",
-                                    data=df1.to_csv(index=False).encode("utf-8-sig"),
+                                    data=partial(to_csv_bytes, df1),
                                     file_name=f"{tbl_preview}_only_in_OLD_sample.csv",
                                     mime="text/csv",
                                     key="dl_prev_only_old"
                                 )
                         with c2:
                             st.write("🔺 อยู่ใน NEW แต่ไม่อยู่ใน OLD (จาก sample)")
-                            df2 = tuples_to_df(only_new)
                             st.dataframe(df2, use_container_width=True, key="df_prev_only_new")
                             if not df2.empty:
                                 st.download_button(
                                     "⬇️ CSV (Only in NEW - sample)",
-                                    data=df2.to_csv(index=False).encode("utf-8-sig"),
+                                    data=partial(to_csv_bytes, df2),
                                     file_name=f"{tbl_preview}_only_in_NEW_sample.csv",
                                     mime="text/csv",
                                     key="dl_prev_only_new"
                                 )
                 except Exception as e:
                     st.error(f"เปรียบเทียบไม่สำเร็จ: {e}")
-else:
-    if not ok_old or not ok_new:
-        st.info("ยังเชื่อมต่อฐานข้อมูลไม่ได้ กรุณาตั้งค่าจากปุ่ม ‘ตั้งค่าเชื่อมต่อฐานข้อมูล’ ด้านบนก่อน")
+    else:
+        if not ok_old or not ok_new:
+            st.info("ยังเชื่อมต่อฐานข้อมูลไม่ได้ กรุณาตั้งค่าจากปุ่ม ‘ตั้งค่าเชื่อมต่อฐานข้อมูล’ ด้านบนก่อน")
 
 # ================================
-# Notes
+# Streamlit UI
 # ================================
-st.caption(
-    "หมายเหตุ: โค้ดนี้ใช้ WITH (NOLOCK) เพื่ออ่านเร็วและลดการล็อก เหมาะกับการตรวจสอบ/อ่านอย่างเดียว "
-    "หากต้องการความถูกต้องระดับธุรกรรม 100% ให้พิจารณาเอา NOLOCK ออกตามเหมาะสม."
-)
+def main():
+    st.set_page_config(page_title="DB Compare (Old vs New)", page_icon="🧪", layout="wide")
+    st.title("🧪 เปรียบเทียบข้อมูล: ฐานเก่า vs ฐานใหม่")
+
+    cfg = load_config()
+    tables = load_tables()
+
+    # ---- CONFIG POPUP / EXPANDER ----
+    config_editor_ui(cfg)
+
+    st.divider()
+
+    # ---- Connection Status
+    st.subheader("สถานะการเชื่อมต่อ")
+    conn_str_old = build_conn_str(cfg, "old_db")
+    conn_str_new = build_conn_str(cfg, "new_db")
+    new_prefix = new_ref_prefix(cfg)
+    cfg_sig = config_signature(cfg)
+
+    col_status, col_edit_tables = st.columns([1, 1])
+    with col_status:
+        if st.button("🔄 Reconnect", key="btn_reconnect"):
+            reset_conns()
+
+        ok_old = ok_new = False
+        try:
+            get_conn("old", conn_str_old)
+            st.success("OLD: เชื่อมต่อได้")
+            ok_old = True
+        except Exception as e:
+            st.error(f"OLD: เชื่อมต่อไม่ได้ - {e}")
+
+        try:
+            get_conn("new", conn_str_new)
+            st.success("NEW: เชื่อมต่อได้")
+            ok_new = True
+        except Exception as e:
+            st.error(f"NEW: เชื่อมต่อไม่ได้ - {e}")
+
+    with col_edit_tables:
+        st.subheader("จัดการ tables.json")
+        tables_editor = st.text_area("แก้ไขรายการตาราง", value=json_text_cached(str(TABLES_PATH), TABLES_PATH.stat().st_mtime_ns), height=200, key="tables_editor")
+        if st.button("💾 บันทึก tables.json", key="btn_save_tables"):
+            try:
+                new_tbls = json.loads(tables_editor)
+                if save_json(TABLES_PATH, new_tbls):
+                    st.session_state.pop("common_cols_cache", None)
+                    st.success("บันทึกสำเร็จ")
+                    st.rerun()
+            except Exception as e:
+                st.error(f"รูปแบบ JSON ไม่ถูกต้อง: {e}")
+
+    st.divider()
+
+    # ---- Compare Section
+    st.header("🔍 Compare (Schema/Rows/Checksum)")
+
+    compare_section(tables, conn_str_old, conn_str_new, ok_old, ok_new, new_prefix, cfg_sig)
+
+    st.divider()
+
+    # ---- Data Preview Section
+    data_preview_section(cfg, tables, conn_str_old, conn_str_new, ok_old, ok_new, cfg_sig)
+
+    # ---- Notes
+    st.caption(
+        "หมายเหตุ: row count / checksum / หาแถวที่ต่าง อ่านแบบ READ COMMITTED (ไม่ใช้ NOLOCK) เพื่อไม่ให้ได้แถวซ้ำหรือหายระหว่าง scan "
+        "— ถ้าฐานเปิด READ_COMMITTED_SNAPSHOT จะอ่านจาก row version โดยไม่รอ lock; NOLOCK ใช้เฉพาะการดูตัวอย่างข้อมูลเมื่อเปิดตัวเลือกไว้"
+    )
+
+
+if __name__ == "__main__":
+    # streamlit run รันสคริปต์เป็น __main__; import จาก test จะได้แค่ฟังก์ชัน ไม่วาด UI
+    main()
@@ -0,0 +1,186 @@
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+import main
+
+pa = pytest.importorskip("pyarrow")
+
+
+def arrow(values, arrow_type):
+    return pd.array(values, dtype=pd.ArrowDtype(arrow_type))
+
+
+# ================================
+# align_dtypes
+# ================================
+def test_align_dtypes_keeps_matching_columns():
+    left = pd.DataFrame({"a": [1, 2]})
+    right = pd.DataFrame({"a": [3]})
+    out_left, out_right = main.align_dtypes(left, right)
+    assert out_left is left and out_right is right
+
+
+def test_align_dtypes_int_vs_float_is_not_float64():
+    left, right = main.align_dtypes(pd.DataFrame({"v": [9007199254740993]}),
+                                    pd.DataFrame({"v": [9007199254740992.0]}))
+    assert left["v"].dtype != "float64"
+    assert left["v"].iloc[0] != right["v"].iloc[0]
+
+
+def test_align_dtypes_int_vs_int_nullable():
+    left, right = main.align_dtypes(pd.DataFrame({"v": [2**62 + 1]}),
+                                    pd.DataFrame({"v": pd.array([2**62, None], dtype="Int64")}))
+    assert str(left["v"].dtype) == "Int64" and str(right["v"].dtype) == "Int64"
+    assert left["v"].iloc[0] == 2**62 + 1
+
+
+def test_align_dtypes_decimal_precision():
+    left, right = main.align_dtypes(
+        pd.DataFrame({"v": arrow([Decimal("12345678901234567890123456789.1")], pa.decimal128(38, 1))}),
+        pd.DataFrame({"v": arrow([Decimal("12345678901234567890123456789.12")], pa.decimal128(38, 2))}),
+    )
+    assert left["v"].dtype == right["v"].dtype
+    assert pa.types.is_decimal(left["v"].dtype.pyarrow_dtype)
+    assert left["v"].iloc[0] != right["v"].iloc[0]
+
+
+def test_align_dtypes_int_vs_decimal():
+    left, right = main.align_dtypes(pd.DataFrame({"v": arrow([1, 2], pa.int64())}),
+                                    pd.DataFrame({"v": arrow([Decimal("1"), Decimal("2.5")], pa.decimal128(18, 2))}))
+    assert pa.types.is_decimal(left["v"].dtype.pyarrow_dtype)
+    assert left["v"].iloc[0] == right["v"].iloc[0]
+    assert left["v"].iloc[1] != right["v"].iloc[1]
+
+
+def test_align_dtypes_arrow_int_vs_float_falls_back_to_str():
+    left, right = main.align_dtypes(pd.DataFrame({"v": arrow([2**62 + 1], pa.int64())}),
+                                    pd.DataFrame({"v": arrow([float(2**62)], pa.float64())}))
+    assert left["v"].iloc[0] == str(2**62 + 1)
+    assert left["v"].iloc[0] != right["v"].iloc[0]
+
+
+# ================================
+# diff_frames
+# ================================
+def test_diff_frames_large_int_vs_float():
+    only_old, only_new = main.diff_frames(pd.DataFrame({"v": [9007199254740993]}),
+                                          pd.DataFrame({"v": [9007199254740992.0]}), ["v"])
+    assert len(only_old) == 1 and len(only_new) == 1
+
+
+def test_diff_frames_same_rows_different_dtype():
+    only_old, only_new = main.diff_frames(pd.DataFrame({"k": [1, 2], "v": ["a", "b"]}),
+                                          pd.DataFrame({"k": arrow([2, 1], pa.int64()), "v": ["b", "a"]}), ["k", "v"])
+    assert only_old.empty and only_new.empty
+
+
+def test_diff_frames_dedupes():
+    only_old, only_new = main.diff_frames(pd.DataFrame({"v": [1, 1, 2]}), pd.DataFrame({"v": [2]}), ["v"])
+    assert only_old["v"].tolist() == [1]
+    assert only_new.empty
+
+
+# ================================
+# column_diffs
+# ================================
+def test_column_diffs_reports_changed_cells_only():
+    old = pd.DataFrame({"k": [1, 2], "a": ["x", "y"], "b": [1, None]})
+    new = pd.DataFrame({"k": [1, 2], "a": ["x", "z"], "b": [1, None]})
+    out = main.column_diffs(old, new, ["k"])
+    assert out.to_dict("records") == [{"k": 2, "column": "a", "OLD": "y", "NEW": "z"}]
+
+
+def test_column_diffs_null_one_side():
+    old = pd.DataFrame({"k": [1], "a": arrow(["x"], pa.string())})
+    new = pd.DataFrame({"k": [1], "a": arrow([None], pa.string())})
+    out = main.column_diffs(old, new, ["k"])
+    assert out["column"].tolist() == ["a"]
+
+
+def test_column_diffs_large_int_vs_float():
+    out = main.column_diffs(pd.DataFrame({"k": [1], "v": [2**62 + 1]}),
+                            pd.DataFrame({"k": [1], "v": [float(2**62)]}), ["k"])
+    assert out["column"].tolist() == ["v"]
+
+
+# ================================
+# hash_key_diff
+# ================================
+def fake_row_hashes(frames):
+    """แทน q_row_hashes: conn ที่ส่งเข้ามาคือ key ของ frames"""
+    return lambda conn, table, pk_cols, cols: frames[conn]
+
+
+def test_hash_key_diff(monkeypatch):
+    frames = {
+        "old": pd.DataFrame({"id": [1, 2, 3], "__h": [10, 20, 30]}),
+        "new": pd.DataFrame({"id": [2, 3, 4], "__h": [20, 31, 40]}),
+    }
+    monkeypatch.setattr(main, "q_row_hashes", fake_row_hashes(frames))
+    only_old, only_new, changed = main.hash_key_diff("old", "new", "t", ["id"], ["id", "v"])
+    assert only_old == [{"id": 1}]
+    assert only_new == [{"id": 4}]
+    assert changed == [{"id": 3}]
+
+
+def test_hash_key_diff_large_decimal_keys(monkeypatch):
+    # DECIMAL(38,0) สองค่าที่เป็น float64 ค่าเดียวกัน -> ต้องไม่รวมเป็น key เดียว
+    k1, k2 = Decimal("12345678901234567890123456789"), Decimal("12345678901234567890123456790")
+    frames = {
+        "old": pd.DataFrame({"id": arrow([k1, k2], pa.decimal128(38, 0)), "__h": [1, 2]}),
+        "new": pd.DataFrame({"id": arrow([k1, k2], pa.decimal128(29, 0)), "__h": [1, 3]}),
+    }
+    monkeypatch.setattr(main, "q_row_hashes", fake_row_hashes(frames))
+    only_old, only_new, changed = main.hash_key_diff("old", "new", "t", ["id"], ["id", "v"])
+    assert only_old == [] and only_new == []
+    assert changed == [{"id": k2}]
+
+
+def test_hash_key_diff_composite_key_limit(monkeypatch):
+    frames = {
+        "old": pd.DataFrame({"a": [1, 1, 2], "b": ["x", "y", "x"], "__h": [1, 2, 3]}),
+        "new": pd.DataFrame({"a": [1], "b": ["x"], "__h": [1]}),
+    }
+    monkeypatch.setattr(main, "q_row_hashes", fake_row_hashes(frames))
+    only_old, only_new, changed = main.hash_key_diff("old", "new", "t", ["a", "b"], ["a", "b"], limit=1)
+    assert only_old == [{"a": 1, "b": "y"}]
+    assert only_new == [] and changed == []
+
+
+def test_hash_key_diff_returns_native_key_values(monkeypatch):
+    # ฝั่ง NEW ว่าง -> dtype ต่างกัน แต่ค่า PK ที่คืนต้องเป็น int เดิม (ใช้เป็น parameter ของ q_rows_by_keys)
+    frames = {
+        "old": pd.DataFrame({"k1": [1, 9007199254740993], "__h": [1, 2]}),
+        "new": pd.DataFrame({"k1": pd.Series([], dtype=object), "__h": pd.Series([], dtype="int64")}),
+    }
+    monkeypatch.setattr(main, "q_row_hashes", fake_row_hashes(frames))
+    only_old, only_new, changed = main.hash_key_diff("old", "new", "t", ["k1"], ["k1"])
+    assert only_old == [{"k1": 1}, {"k1": 9007199254740993}]
+    assert all(type(k["k1"]) is int for k in only_old)
+    assert only_new == [] and changed == []
+
+
+@pytest.mark.parametrize("side", ["old", "new"])
+def test_hash_key_diff_duplicate_keys_returns_none(monkeypatch, side):
+    frames = {
+        "old": pd.DataFrame({"id": [1, 2], "__h": [10, 20]}),
+        "new": pd.DataFrame({"id": [1, 2], "__h": [10, 21]}),
+    }
+    frames[side] = pd.DataFrame({"id": [1, 2, 2], "__h": [10, 20, 20]})
+    monkeypatch.setattr(main, "q_row_hashes", fake_row_hashes(frames))
+    assert main.hash_key_diff("old", "new", "t", ["id"], ["id", "v"]) is None
+
+
+# ================================
+# iter_compare_tables
+# ================================
+def test_iter_compare_tables_connection_error_is_per_table_result(monkeypatch):
+    def fail_open(conn_str):
+        raise RuntimeError("login failed")
+
+    monkeypatch.setattr(main, "open_conn", fail_open)
+    results = dict(main.iter_compare_tables("old", "new", ["a", "b"]))
+    assert set(results) == {"a", "b"}
+    assert all(not r["ok"] and "login failed" in r["messages"][0] for r in results.values())